@@ -1,11 +1,20 @@
 import click
 import os
 from os.path import join
-from jobpoller import JobPoller
-from codebuild_emulator import CodebuildEmulator
+
+# boto3 and docker are only imported by the commands that use them, so that
+# `cbemu --help` does not pay for loading botocore.
 
 cwd = os.getcwd()
 target = join(cwd, 'artifacts')
+secondary_target = join(cwd, 'secondary_artifacts')
+
+
+def _docker_pool(docker_hosts, docker_version):
+    if not docker_hosts:
+        return None
+    from docker_pool import DockerHostPool
+    return DockerHostPool.from_file(docker_hosts, docker_version=docker_version)
 
 
 @click.group()
@@ -18,9 +27,27 @@ def main():
 @click.option('--docker-version', default='auto')
 @click.option('--no-assume', is_flag=True)
 @click.option('--debug', is_flag=True)
-def server(provider, docker_version, no_assume, debug):
-    emulator = CodebuildEmulator(docker_version=docker_version, assume_role=not no_assume, debug=debug)
-    poller = JobPoller({'category': 'Build', 'owner': 'Custom', 'provider': provider, 'version': '1'}, emulator)
+@click.option('--docker-cache', is_flag=True)
+@click.option('--docker-cache-size', default=20, type=int)
+@click.option('--max-builds', default=4, type=int)
+@click.option('--docker-hosts', type=click.Path(exists=True, dir_okay=False))
+@click.option('--status-port', type=int)
+@click.option('--status-host', default='127.0.0.1')
+def server(provider, docker_version, no_assume, debug, docker_cache, docker_cache_size, max_builds, docker_hosts,
+           status_port, status_host):
+    from jobpoller import JobPoller
+    from codebuild_emulator import CodebuildEmulator
+    from build_history import BuildHistory
+    emulator = CodebuildEmulator(docker_version=docker_version, assume_role=not no_assume, debug=debug,
+                                 docker_cache=docker_cache, docker_cache_size=docker_cache_size * 1024 ** 3,
+                                 history=BuildHistory(), docker_pool=_docker_pool(docker_hosts, docker_version))
+    registry = None
+    if status_port:
+        from status_server import BuildRegistry, StatusServer
+        registry = BuildRegistry()
+        StatusServer((status_host, status_port), registry).start()
+    poller = JobPoller({'category': 'Build', 'owner': 'Custom', 'provider': provider, 'version': '1'}, emulator,
+                       max_builds=max_builds, registry=registry)
     poller.poll()
 
 
@@ -33,18 +60,77 @@ def server(provider, docker_version, no_assume, debug):
 @click.option('--debug', is_flag=True)
 @click.option('--pull', is_flag=True)
 @click.option('--override')
-def developer(project, input_dir, target_dir, docker_version, no_assume, debug, override, pull):
+@click.option('--docker-cache', is_flag=True)
+@click.option('--docker-cache-size', default=20, type=int)
+@click.option('--docker-hosts', type=click.Path(exists=True, dir_okay=False))
+@click.option('--secondary-input', multiple=True)
+@click.option('--secondary-target-dir', default=secondary_target)
+@click.option('--resume', is_flag=True)
+@click.option('--watch', is_flag=True)
+@click.option('--watch-rules', type=click.Path(exists=True, dir_okay=False))
+def developer(project, input_dir, target_dir, docker_version, no_assume, debug, override, pull, docker_cache, docker_cache_size,
+              docker_hosts, secondary_input, secondary_target_dir, resume, watch, watch_rules):
+    from codebuild_emulator import CodebuildEmulator
+    from build_history import BuildHistory
     override_envs = {}
     if override:
         for envs in override.split(','):
             env,value = envs.split('=')
             override_envs[env] = value
-    emulator = CodebuildEmulator(docker_version=docker_version, assume_role=not no_assume, debug=debug, override=override_envs, pull_image=pull)
-    emulator.run({'ProjectName': project}, input_src=input_dir, target_dir=target_dir)
+    secondary_sources = {}
+    for source in secondary_input:
+        name, directory = source.split('=', 1)
+        secondary_sources[name] = directory
+    emulator = CodebuildEmulator(docker_version=docker_version, assume_role=not no_assume, debug=debug, override=override_envs, pull_image=pull,
+                                 docker_cache=docker_cache, docker_cache_size=docker_cache_size * 1024 ** 3,
+                                 history=BuildHistory(), docker_pool=_docker_pool(docker_hosts, docker_version),
+                                 keep_failed=True, resume=resume)
+    if watch:
+        _watch(emulator, project, input_dir, target_dir, secondary_sources, secondary_target_dir, debug, watch_rules)
+        return
+    emulator.run({'ProjectName': project}, input_src=input_dir, target_dir=target_dir,
+                 secondary_sources=secondary_sources, secondary_target_dir=secondary_target_dir)
+
+
+def _watch(emulator, project, input_dir, target_dir, secondary_sources, secondary_target_dir, debug, watch_rules):
+    from watcher import SourceWatcher, WatchRules, default_rules_file
+    if debug:
+        raise click.UsageError('--debug can not be used with --watch')
+    if not watch_rules and os.path.exists(join(input_dir, default_rules_file)):
+        watch_rules = join(input_dir, default_rules_file)
+    rules = WatchRules.from_file(watch_rules) if watch_rules else WatchRules()
+    # the artifacts are often copied into the watched directory
+    watcher = SourceWatcher(input_dir, ignore=[target_dir, secondary_target_dir])
+    try:
+        emulator.watch({'ProjectName': project}, watcher, rules, input_src=input_dir, target_dir=target_dir,
+                       secondary_sources=secondary_sources, secondary_target_dir=secondary_target_dir)
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command()
+@click.option('--project', required=True)
+@click.option('--days', default=30, type=int)
+def history(project, days):
+    from build_history import BuildHistory
+    build_history = BuildHistory()
+    reports = build_history.load(project, days=days)
+    if not reports:
+        print('No builds of %s in the last %d days' % (project, days))
+        return
+
+    failed = len([report for report in reports if report.get('exit_code') != 0])
+    print('%d builds of %s in the last %d days, %d failed' % (len(reports), project, days, failed))
+    print('%-12s %6s %10s %10s %10s %8s' % ('phase', 'runs', 'p50', 'p95', 'last', 'trend'))
+    for stats in build_history.phase_stats(reports):
+        trend = '%+.0f%%' % (stats['trend'] * 100) if stats['trend'] is not None else '-'
+        print('%-12s %6d %9.1fs %9.1fs %9.1fs %8s' % (stats['phase'], stats['runs'], stats['p50'],
+                                                     stats['p95'], stats['last'], trend))
 
 
 main.add_command(server)
 main.add_command(developer)
+main.add_command(history)
 
 
 if __name__ == '__main__':
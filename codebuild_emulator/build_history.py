@@ -0,0 +1,80 @@
+import os
+from os.path import join
+import json
+import math
+import re
+import time
+from docker_cache import default_cache_dir
+
+default_history_dir = join(default_cache_dir, 'history')
+
+
+# Build reports are appended as json lines to <history dir>/<project>/<YYYY-MM-DD>.jsonl
+class BuildHistory:
+
+    def __init__(self, history_dir=default_history_dir):
+        self._history_dir = history_dir
+
+    def append(self, report):
+        project_dir = self._project_dir(report['project'])
+        if not os.path.exists(project_dir):
+            os.makedirs(project_dir)
+        day = time.strftime('%Y-%m-%d', time.gmtime(report['start']))
+        with open(join(project_dir, day + '.jsonl'), 'a') as historyfile:
+            historyfile.write(json.dumps(report) + '\n')
+
+    def load(self, project_name, days=None):
+        project_dir = self._project_dir(project_name)
+        if not os.path.exists(project_dir):
+            return []
+        oldest = time.strftime('%Y-%m-%d', time.gmtime(time.time() - days * 86400)) if days else ''
+
+        reports = []
+        for file_name in sorted(os.listdir(project_dir)):
+            if not file_name.endswith('.jsonl') or file_name[:-len('.jsonl')] < oldest:
+                continue
+            with open(join(project_dir, file_name), 'r') as historyfile:
+                for line in historyfile:
+                    if line.strip():
+                        reports.append(json.loads(line))
+        return sorted(reports, key=lambda report: report['start'])
+
+    def phase_stats(self, reports):
+        durations = {}
+        for report in reports:
+            for phase in report.get('phases', []):
+                if 'duration' in phase:
+                    durations.setdefault(phase['name'], []).append(phase['duration'])
+
+        stats = []
+        for name in self._phase_order(reports):
+            values = durations[name]
+            # trend compares the median of the latest half of the runs with the oldest half
+            older, newer = values[:len(values) // 2], values[len(values) // 2:]
+            trend = None
+            if older and percentile(older, 50) > 0:
+                trend = float(percentile(newer, 50)) / percentile(older, 50) - 1
+            stats.append({'phase': name,
+                          'runs': len(values),
+                          'p50': percentile(values, 50),
+                          'p95': percentile(values, 95),
+                          'last': values[-1],
+                          'trend': trend})
+        return stats
+
+    def _phase_order(self, reports):
+        names = []
+        for report in reports:
+            for phase in report.get('phases', []):
+                if 'duration' in phase and phase['name'] not in names:
+                    names.append(phase['name'])
+        return names
+
+    def _project_dir(self, project_name):
+        return join(self._history_dir, re.sub('[^a-zA-Z0-9_.-]', '-', project_name))
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
@@ -5,18 +5,131 @@ import os
 from os.path import join
 import subprocess
 import yaml
-import glob
+import re
 import json
 import time
+import hashlib
+import threading
+import sys
+from pwd import getpwnam
+
+phase_names = ['install', 'pre_build', 'build', 'post_build']
+
+
+# CodeBuild artifact patterns, relative to the base directory: '*' and '?' stay within a directory,
+# '**' is any number of directories. All the patterns are compiled into one regex and the tree is
+# walked once, skipping the directories no pattern can match files in
+class ArtifactMatcher:
+
+    def __init__(self, patterns, exclude_patterns=()):
+        patterns = [self._normalize(pattern) for pattern in patterns]
+        self._include = self._compile(patterns)
+        self._exclude = self._compile([self._normalize(pattern) for pattern in exclude_patterns])
+        self._directory_patterns = [self._compile_directories(pattern) for pattern in patterns]
+
+    def _normalize(self, pattern):
+        pattern = str(pattern).strip()
+        while pattern.startswith('./'):
+            pattern = pattern[2:]
+        return pattern.strip('/')
+
+    def _compile(self, patterns):
+        if not patterns:
+            return None
+        return re.compile('(?:%s)\\Z' % '|'.join('(?:%s)' % self._translate(pattern) for pattern in patterns))
+
+    def _translate(self, pattern):
+        segments = pattern.split('/')
+        regex = ''
+        for position, segment in enumerate(segments):
+            last = position == len(segments) - 1
+            if segment == '**':
+                regex += '.*' if last else '(?:[^/]*/)*'
+            else:
+                regex += self._translate_segment(segment) + ('' if last else '/')
+        return regex
+
+    def _translate_segment(self, segment):
+        regex = ''
+        i = 0
+        while i < len(segment):
+            c = segment[i]
+            i += 1
+            if c == '*':
+                while i < len(segment) and segment[i] == '*':
+                    i += 1
+                regex += '[^/]*'
+            elif c == '?':
+                regex += '[^/]'
+            elif c == '[':
+                j = i
+                if j < len(segment) and segment[j] in '!^':
+                    j += 1
+                if j < len(segment) and segment[j] == ']':
+                    j += 1
+                j = segment.find(']', j)
+                if j < 0:
+                    regex += '\\['
+                    continue
+                chars = segment[i:j].replace('\\', '\\\\')
+                i = j + 1
+                if chars[0] in '!^':
+                    chars = '^/' + chars[1:]
+                regex += '[%s]' % chars
+            else:
+                regex += re.escape(c)
+        return regex
+
+    # the directories a pattern can match files in, as one regex per directory level.
+    # None stands for '**' and matches all the directories below
+    def _compile_directories(self, pattern):
+        segments = pattern.split('/')
+        directories = segments[:-1] + (['**'] if segments[-1] == '**' else [])
+        return [None if segment == '**' else re.compile(self._translate_segment(segment) + '\\Z')
+                for segment in directories]
+
+    def _may_contain_files(self, directories):
+        for directory_pattern in self._directory_patterns:
+            for position, name in enumerate(directories):
+                if position >= len(directory_pattern):
+                    break
+                if directory_pattern[position] is None:
+                    return True
+                if not directory_pattern[position].match(name):
+                    break
+            else:
+                return True
+        return False
+
+    def matches(self, path):
+        return bool(self._include and self._include.match(path)) and \
+            not (self._exclude and self._exclude.match(path))
+
+    # paths of the matching files relative to base, with '/' separators
+    def walk(self, base):
+        if not self._include:
+            return
+        for root, dirs, files in os.walk(base, followlinks=True):
+            relative_root = os.path.relpath(root, base)
+            directories = [] if relative_root == '.' else relative_root.split(os.sep)
+            prefix = ''.join(directory + '/' for directory in directories)
+            dirs[:] = [name for name in dirs if self._may_contain_files(directories + [name])]
+            for name in files:
+                if self.matches(prefix + name):
+                    yield prefix + name
+
+
 
 class CodebuildBuilder:
 
-    def __init__(self, input_dir, output_dir, debug):
+    def __init__(self, input_dir, output_dir, debug, resume_from=None):
        self._input_dir = input_dir
        self._output_dir = output_dir
        self._debug = debug or os.path.exists(join(output_dir, 'debug'))
+       self._resume_from = resume_from or 0
        self._returncodes = {}
        self._succeeded = True
+       self._report = {'phases': [], 'artifacts': []}
 
     def _parse_buildspec(self):
         buildspec = self._get_buiildspec()
@@ -24,30 +137,97 @@ class CodebuildBuilder:
         self._envs = buildspec.get('env', {}).get('variables', [])
         self._phases = buildspec['phases']
         self._artifacts = buildspec.get('artifacts', [])
+        self._run_as = buildspec.get('run-as')
+        self._plan = self._compile_plan()
+
+    # every command of the build gets an index, the results and resume_from refer to it
+    def _compile_plan(self):
+        plan = []
+        index = 0
+        for phase_name in phase_names:
+            phase = self._phases.get(phase_name)
+            if not phase:
+                continue
+            steps = {}
+            for block in ['commands', 'finally']:
+                steps[block] = []
+                for command in phase.get(block) or []:
+                    steps[block].append((index, str(command)))
+                    index += 1
+            plan.append({'name': phase_name,
+                         'commands': steps['commands'],
+                         'finally': steps['finally'],
+                         'on_failure': phase.get('on-failure', 'ABORT'),
+                         'run_as': phase.get('run-as', self._run_as),
+                         'runtime_versions': phase.get('runtime-versions') or {}})
+        return plan
+
+    def _write_plan(self):
+        steps = []
+        for phase in self._plan:
+            for block in ['commands', 'finally']:
+                for index, command in phase[block]:
+                    steps.append({'index': index, 'phase': phase['name'], 'block': block, 'command': command,
+                                  'on_failure': phase['on_failure']})
+        with open(join(self._output_dir, 'plan.json'), 'w') as planfile:
+            json.dump(steps, planfile)
+
+    def _write_env(self):
+        envsh = join(self._output_dir, 'tmp', 'env.sh')
+        if os.path.exists(envsh):
+            return
+        with open(envsh, 'w') as envshfile:
+            envshfile.write("export CODEBUILD_SRC_DIR=%s\n" % self._src)
+            # artifact names may contain characters a shell variable name can not
+            for name in self._secondary_srcs:
+                envshfile.write("export CODEBUILD_SRC_DIR_%s=%s\n" % (re.sub('[^a-zA-Z0-9_]', '_', name),
+                                                                     self._secondary_srcs[name]))
+            with open(join(self._input_dir, 'variables.json'), 'r') as variablesfile:
+                variables = json.load(variablesfile)
+            for key in variables:
+                envshfile.write("export %s=%s\n" % (key, variables[key]))
+            for key in self._envs:
+                envshfile.write("export %s=%s\n" % (key, self._envs[key]))
+        # it holds the credentials
+        os.chmod(envsh, 0o600)
 
     def _run_phase(self, phase_name):
-        if not phase_name in self._phases:
+        phase = dict((phase['name'], phase) for phase in self._plan).get(phase_name)
+        if not phase:
             self._returncodes[phase_name] = 0
             return True
 
-        tmp = join(self._output_dir, 'tmp')
-        envsh = join(tmp, 'env.sh')
+        self._write_env()
+
+        print('Running phase %s' % phase_name)
+        for runtime in sorted(phase['runtime_versions']):
+            print('runtime-versions %s: %s is not installed by codebuild-emulator, the image has to provide it'
+                  % (runtime, phase['runtime_versions'][runtime]))
+        sys.stdout.flush()
+
+        phase_report = {'name': phase_name, 'start': time.time(), 'commands': []}
+        self._report['phases'].append(phase_report)
 
-        if not os.path.exists(envsh):
-           with open(envsh, 'w') as envshfile:
-               with open(join(self._input_dir, 'variables.json'), 'r') as variablesfile:
-                   variables = json.load(variablesfile)
-               for key in variables:
-                   envshfile.write("export %s=%s\n" % (key, variables[key]))
-               for key in self._envs:
-                   envshfile.write("export %s=%s\n" % (key, self._envs[key]))
-           os.chmod(envsh, 500)
+        rc = self._run_commands(phase, phase['commands'], phase_report)
+        # finally commands run even when a command failed
+        if phase['finally']:
+            finally_rc = self._run_commands(phase, phase['finally'], phase_report)
+            rc = rc or finally_rc
 
+        phase_report['status'] = 'FAILED' if rc != 0 else 'SUCCEEDED'
+        phase_report['duration'] = time.time() - phase_report['start']
+        self._returncodes[phase_name] = rc
+        return rc == 0
+
+    def _run_commands(self, phase, commands, phase_report):
+        tmp = join(self._output_dir, 'tmp')
+        envsh = join(tmp, 'env.sh')
         shell = join(tmp, 'shell.sh')
         pwd = join(tmp, 'pwd.txt')
 
-        rc = 0
-        for command in self._phases[phase_name]['commands']:
+        for index, command in commands:
+            if index < self._resume_from:
+                continue
             with open(shell, 'w') as shellfile:
                 shellfile.write("cd $(cat %s)\n" % pwd)
                 shellfile.write(". %s\n" % envsh)
@@ -55,7 +235,8 @@ class CodebuildBuilder:
                 shellfile.write(command + '\n')
                 shellfile.write("export -p > %s\n" % envsh)
                 shellfile.write("pwd > %s\n" % pwd)
-            os.chmod(shell, 500)
+            os.chmod(shell, 0o700)
+            self._save_state(index)
             # debug mode
             if self._debug:
                 print('\n' + '=' * 128)
@@ -63,38 +244,58 @@ class CodebuildBuilder:
                 print('Do you want to run this command ? [Enter/S] ')
                 skip = self._wait_for_debug()
                 if skip:
+                   phase_report['commands'].append({'command': command, 'skipped': True})
+                   self._record_result(index, None, 0)
                    continue
 
-            rc = subprocess.call(shell, shell=True)
+            start = time.time()
+            if phase['run_as']:
+                rc = self._call_as(phase['run_as'], shell, [shell, envsh, pwd])
+            else:
+                rc = subprocess.call(shell, shell=True)
+            duration = time.time() - start
+            phase_report['commands'].append({'command': command,
+                                             'exit_code': rc,
+                                             'duration': duration})
+            self._record_result(index, rc, duration)
 
             if not rc == 0:
                 self._succeeded = False
-                if not self._debug:
-                    break
-
-        self._returncodes[phase_name] = rc
-        return rc == 0
+                return rc
+        return 0
 
-    def _upload_artifacts(self):
-        base_directory = self._artifacts['base-directory'] + '/' if 'base-directory' in self._artifacts else ''
-        discard_paths = self._artifacts.get('discard-paths', False)
+    # the user owns the shell state while its command runs, and gives it back before the next one
+    def _call_as(self, user, shell, paths):
+        try:
+            account = getpwnam(user)
+        except KeyError:
+            raise Exception("Unknown run-as user %s" % user)
+        for path in paths:
+            os.chown(path, account.pw_uid, account.pw_gid)
+        try:
+            return subprocess.call(['su', user, '-s', '/bin/sh', '-c', shell])
+        finally:
+            for path in paths:
+                os.chown(path, os.getuid(), os.getgid())
 
-        artifact_dir = join(self._output_dir, 'artifacts')
+    # one [index, exit code, milliseconds] line per command, written as soon as it is done
+    def _record_result(self, index, rc, duration):
+        with open(join(self._output_dir, 'results'), 'a') as resultsfile:
+            resultsfile.write(json.dumps([index, rc, int(duration * 1000)]) + '\n')
 
+    def _upload_artifacts(self):
         print("Uploading artifacts")
 
-        if '**/*' in self._artifacts['files']:
-            shutil.copytree(join(self._src, base_directory), artifact_dir)
-        else:
-            os.mkdir(artifact_dir)
-            for element in self._artifacts['files']:
-                for artifact in glob.glob(join(self._src, base_directory, element)):
-                    if os.path.isdir(artifact):
-                        continue
-                    if discard_paths:
-                        shutil.copy2(artifact, artifact_dir)
-                    else:
-                        subprocess.Popen(['cp', '--parents',artifact,artifact_dir], cwd=self._src).wait()
+        uploads = []
+        if 'files' in self._artifacts:
+            uploads.append((self._upload_artifact, (self._artifacts, join(self._output_dir, 'artifacts'), None)))
+        secondary_artifacts = self._artifacts.get('secondary-artifacts') or {}
+        if secondary_artifacts:
+            os.mkdir(join(self._output_dir, 'secondary_artifacts'))
+        for name in secondary_artifacts:
+            artifact_dir = join(self._output_dir, 'secondary_artifacts', name)
+            uploads.append((self._upload_artifact, (secondary_artifacts[name], artifact_dir, name)))
+        self._run_parallel(uploads)
 
         uid = int(os.environ['CBEMU_UID']) if 'CBEMU_UID' in os.environ else None
         gid = int(os.environ['CBEMU_GID']) if 'CBEMU_GID' in os.environ else None
@@ -106,6 +307,61 @@ class CodebuildBuilder:
                 for file in files:
                     os.chown(join(root, file), uid, gid)
 
+    def _upload_artifact(self, artifact, artifact_dir, name):
+        base = join(self._src, artifact.get('base-directory', ''))
+        discard_paths = artifact.get('discard-paths', False)
+        matcher = ArtifactMatcher(artifact['files'], artifact.get('exclude-paths') or [])
+
+        os.mkdir(artifact_dir)
+        created = set([artifact_dir])
+        for path in matcher.walk(base):
+            destination = join(artifact_dir, os.path.basename(path) if discard_paths else path)
+            destination_dir = os.path.dirname(destination)
+            if destination_dir not in created:
+                if not os.path.exists(destination_dir):
+                    os.makedirs(destination_dir)
+                created.add(destination_dir)
+            shutil.copy2(join(base, path), destination)
+
+        for root, dirs, files in os.walk(artifact_dir):
+            for file in files:
+                description = self._describe_artifact(artifact_dir, join(root, file))
+                if name:
+                    description['artifact'] = name
+                self._report['artifacts'].append(description)
+
+    def _run_parallel(self, calls):
+        errors = []
+
+        def call(func, args):
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call, args=(func, args)) for func, args in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _describe_artifact(self, artifact_dir, path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as artifact:
+            for chunk in iter(lambda: artifact.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return {'path': os.path.relpath(path, artifact_dir),
+                'size': os.path.getsize(path),
+                'sha256': sha256.hexdigest()}
+
+    def _write_report(self):
+        self._report['succeeded'] = self._succeeded
+        self._report['returncodes'] = self._returncodes
+        with open(join(self._output_dir, 'report.json'), 'w') as reportfile:
+            json.dump(self._report, reportfile)
+
     def _process_buildspec_phase(self, phases, phase_name):
         if phase_name in phases:
             commands = phases[phase_name]['commands']
@@ -120,26 +376,122 @@ class CodebuildBuilder:
 
     def _prepare_output(self):
         self._src = join(self._output_dir, 'src123456789')
-        shutil.copytree(join(self._input_dir, 'src'),
-                        self._src)
+        copies = [(self._copy_source, (join(self._input_dir, 'src'), self._src, self._read_changed_sources()))]
+
+        # secondary sources, one directory per source identifier
+        self._secondary_srcs = {}
+        sources_dir = join(self._input_dir, 'sources')
+        if os.path.exists(sources_dir):
+            for name in sorted(os.listdir(sources_dir)):
+                self._secondary_srcs[name] = join(self._output_dir, 'src_' + name)
+                copies.append((self._copy_source, (join(sources_dir, name), self._secondary_srcs[name])))
+        self._run_parallel(copies)
+
+        # a resumed build starts with the environment and working directory its first command had
         tmp = join(self._output_dir, 'tmp')
+        if self._resume_from and self._restore_state(self._resume_from):
+            return
+        if self._resume_from and os.path.exists(tmp):
+            return
+        shutil.rmtree(tmp, ignore_errors=True)
         os.mkdir(tmp)
 
         with open(join(tmp, 'pwd.txt'), 'w') as pwdfile:
             pwdfile.write(self._src)
 
-    def _run_phases(self):
-        if self._run_phase('install') and self._run_phase('pre_build'):
-            self._run_phase('build')
-            self._run_phase('post_build')
-            return True
-        else:
+    # env.sh and pwd.txt as they were before each command ran
+    def _save_state(self, index):
+        tmp = join(self._output_dir, 'tmp')
+        state = join(tmp, 'state', str(index))
+        shutil.rmtree(state, ignore_errors=True)
+        os.makedirs(state)
+        for name in ['env.sh', 'pwd.txt']:
+            shutil.copy2(join(tmp, name), join(state, name))
+
+    def _restore_state(self, index):
+        tmp = join(self._output_dir, 'tmp')
+        state = join(tmp, 'state', str(index))
+        if not os.path.exists(state):
             return False
+        print('Restoring the environment and working directory of command %d' % index)
+        for name in ['env.sh', 'pwd.txt']:
+            if os.path.lexists(join(tmp, name)):
+                os.unlink(join(tmp, name))
+            shutil.copy2(join(state, name), join(tmp, name))
+        return True
+
+    # paths of the primary source the host changed since the previous run, in watch mode
+    def _read_changed_sources(self):
+        changed_path = join(self._output_dir, 'changed_sources')
+        if not os.path.exists(changed_path):
+            return None
+        with open(changed_path, 'r') as changedfile:
+            changed = json.load(changedfile)
+        os.unlink(changed_path)
+        return changed
+
+    def _copy_source(self, source, destination, changed=None):
+        if not os.path.exists(destination):
+            shutil.copytree(source, destination)
+            return
+        if changed is not None:
+            for path in changed:
+                self._copy_path(join(source, path), join(destination, path))
+            return
+        # only copy what changed since the previous run
+        for root, dirs, files in os.walk(source):
+            target_root = join(destination, os.path.relpath(root, source))
+            if not os.path.exists(target_root):
+                os.makedirs(target_root)
+            for file in files:
+                path = join(root, file)
+                target = join(target_root, file)
+                if os.path.islink(path) or not os.path.exists(target) or \
+                        os.path.getsize(path) != os.path.getsize(target) or \
+                        os.path.getmtime(path) != os.path.getmtime(target):
+                    self._copy_path(path, target)
+
+    # replaces target with path, or removes it when path was deleted
+    def _copy_path(self, path, target):
+        if os.path.isdir(target) and not os.path.islink(target):
+            shutil.rmtree(target)
+        elif os.path.lexists(target):
+            os.unlink(target)
+        if not os.path.lexists(path):
+            return
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), target)
+        elif os.path.isdir(path):
+            shutil.copytree(path, target, symlinks=True)
+        else:
+            shutil.copy2(path, target)
+
+    def _run_phases(self):
+        # install and pre_build failures end the build unless their on-failure is CONTINUE,
+        # post_build always runs after build
+        for phase in self._plan:
+            if not self._run_phase(phase['name']) and phase['on_failure'] != 'CONTINUE' \
+                    and phase['name'] in ['install', 'pre_build']:
+                return False
+        return True
 
     def run(self):
         try:
+            # leftovers of the build this one resumes
+            for name in ['results', 'artifacts', 'secondary_artifacts']:
+                path = join(self._output_dir, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.unlink(path)
+
             self._prepare_output()
             self._parse_buildspec()
+            self._write_plan()
+            if self._resume_from:
+                print('Resuming from command %d' % self._resume_from)
 
             if self._run_phases() and self._artifacts:
                 self._upload_artifacts()
@@ -147,7 +499,10 @@ class CodebuildBuilder:
             if not self._succeeded:
                 raise Exception('Build failed')
         except:
+            self._succeeded = False
             raise
+        finally:
+            self._write_report()
 
     def _wait_for_debug(self):
         skip = False
@@ -168,5 +523,6 @@ class CodebuildBuilder:
 if __name__ == '__main__':
     builder = CodebuildBuilder(input_dir='/codebuild/readonly',
                                output_dir='/codebuild/output',
-                               debug=False)
+                               debug=False,
+                               resume_from=int(os.environ.get('CBEMU_RESUME_FROM', 0)))
     builder.run()
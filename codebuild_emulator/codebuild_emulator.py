@@ -4,27 +4,69 @@ from os.path import join
 import tempfile
 import shutil
 import json
-import boto3
-import docker
 import time
 import threading
 import sys
+import tarfile
+import re
+import calendar
+from docker_cache import DockerLayerCache, default_cache_dir
+from resilience import retry, backoff_delay, metrics, docker_breaker, any_error
+from watcher import phase_names
+from status_server import max_line_length
 
 cwd = os.getcwd()
 target = join(cwd, 'artifacts')
+max_log_attempts = 10
+# docker prefixes each line with the time it was logged when timestamps=True, 2019-05-02T10:15:31.123456789Z
+log_timestamp_pattern = re.compile(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d{1,9}))?Z$')
+max_log_timestamp_length = 40
 default_script_path = join(os.path.dirname(os.path.realpath(__file__)), 'codebuild_builder.py')
 
 
+# (seconds, nanoseconds) strings that compare in time order, None when text is not a timestamp
+def parse_log_timestamp(text):
+    match = log_timestamp_pattern.match(text)
+    if not match:
+        return None
+    return match.group(1), (match.group(2) or '').ljust(9, '0')
+
+
+# calls is a list of (func, args), the first exception is raised once all calls are done
+def run_parallel(calls):
+    errors = []
+
+    def call(func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call, args=(func, args)) for func, args in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
 class CodebuildEmulator:
 
     def __init__(self,
                  docker_version,
-                 codebuild_client=boto3.client('codebuild'),
-                 sts_client=boto3.client('sts'),
+                 codebuild_client=None,
+                 sts_client=None,
                  assume_role=True,
                  debug=False,
                  override={},
-                 pull_image=False):
+                 pull_image=False,
+                 docker_cache=False,
+                 docker_cache_size=None,
+                 history=None,
+                 docker_pool=None,
+                 keep_failed=False,
+                 resume=False):
 
         self._docker_version = docker_version
         self._codebuild_client = codebuild_client
@@ -33,35 +75,163 @@ class CodebuildEmulator:
         self._debug = debug
         self._override = override
         self._pull_image = pull_image
+        self._docker_cache = docker_cache
+        self._docker_cache_size = docker_cache_size
+        self._history = history
+        self._docker_pool = docker_pool
+        self._keep_failed = keep_failed
+        self._resume = resume
+
+    def _get_codebuild_client(self):
+        if self._codebuild_client is None:
+            import boto3
+            self._codebuild_client = boto3.client('codebuild')
+        return self._codebuild_client
 
     def _get_project(self, project_name):
-        response = self._codebuild_client.batch_get_projects(names=[project_name])
+        response = self._get_codebuild_client().batch_get_projects(names=[project_name])
         projects = response['projects']
         if projects:
             return projects[0]
         else:
             raise Exception("No project found")
 
-    def run(self, configuration, input_src=cwd, target_dir=target):
+    def run(self, configuration, input_src=cwd, target_dir=target, secondary_sources={}, secondary_target_dir=None,
+            build_status=None):
+        start = time.time()
         project = self._get_project(configuration['ProjectName'])
-        work_dir = tempfile.mkdtemp()
+        work_dir, resume_from = self._load_resume_state(project['name'])
+        work_dir = work_dir or tempfile.mkdtemp()
 
         run = CodebuildRun(project, input_src, work_dir,
                            self._sts_client, self._docker_version,
+                           secondary_sources=secondary_sources,
+                           build_status=build_status,
                            assume_role=self._assume_role,
                            debug=self._debug,
                            override=self._override,
-                           pull_image=self._pull_image)
+                           pull_image=self._pull_image,
+                           docker_cache=self._docker_cache,
+                           docker_cache_size=self._docker_cache_size,
+                           docker_pool=self._docker_pool,
+                           resume_from=resume_from)
         run.assume_role()
         run.prepare_dirs()
 
-        run.run_container()
-        exit_code = run.wait_for_container()
+        try:
+            run.run_container()
+            exit_code = run.wait_for_container()
+        finally:
+            run.release_docker_cache()
+            run.release_docker_host()
+
+        run.copy_artifacts(target_dir, secondary_target_dir)
+
+        if self._history:
+            report = run.read_report()
+            report.update({'project': project['name'],
+                           'start': start,
+                           'duration': time.time() - start,
+                           'exit_code': exit_code})
+            self._history.append(report)
+
+        failed_step = run.failed_step()
+        if failed_step:
+            print('Build stopped at command %d of %s: %s' % (failed_step['index'], failed_step['phase'],
+                                                            failed_step['command']))
+        if failed_step and self._keep_failed:
+            self._save_resume_state(project['name'], work_dir, failed_step['index'])
+            print('Run again with --resume to continue from this command')
+        else:
+            self._discard_resume_state(project['name'])
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return exit_code
 
-        run.copy_artifacts(target_dir)
+    # blocks while no docker daemon is healthy
+    def wait_for_docker(self):
+        if self._docker_pool:
+            self._docker_pool.wait_until_available()
+        else:
+            docker_breaker.wait_until_closed()
 
-        shutil.rmtree(work_dir, ignore_errors=True)
-        return exit_code
+    # one container and workspace for the whole session, the build runs again in the same container
+    # each time files of input_src change, from the phase the watch rules give for the changed files
+    def watch(self, configuration, watcher, rules, input_src=cwd, target_dir=target, secondary_sources={},
+              secondary_target_dir=None):
+        project = self._get_project(configuration['ProjectName'])
+        work_dir = tempfile.mkdtemp()
+
+        run = CodebuildRun(project, input_src, work_dir,
+                           self._sts_client, self._docker_version,
+                           secondary_sources=secondary_sources,
+                           assume_role=self._assume_role,
+                           override=self._override,
+                           pull_image=self._pull_image,
+                           docker_cache=self._docker_cache,
+                           docker_cache_size=self._docker_cache_size,
+                           docker_pool=self._docker_pool)
+        run.assume_role()
+        run.prepare_dirs()
+
+        try:
+            run.run_container(keep_alive=True)
+            resume_from = 0
+            while True:
+                start = time.time()
+                exit_code = run.exec_executor(resume_from)
+                run.copy_artifacts(target_dir, secondary_target_dir)
+                failed_step = run.failed_step()
+                aborted_step = run.aborted_step()
+                if failed_step:
+                    print('Build stopped at command %d of %s: %s' % (failed_step['index'], failed_step['phase'],
+                                                                    failed_step['command']))
+                print('Build %s in %.1fs, watching %s' % ('failed' if exit_code else 'succeeded',
+                                                         time.time() - start, input_src))
+
+                changed = watcher.wait()
+                run.sync_sources(changed)
+                phase = rules.phase_for(changed)
+                resume_from = run.first_command_index(phase)
+                # the commands after one that aborted its phase never ran
+                if aborted_step:
+                    resume_from = min(resume_from, aborted_step['index'])
+                print('%d files changed, running the build again from command %d' % (len(changed), resume_from))
+        finally:
+            run.remove_container()
+            run.release_docker_cache()
+            run.release_docker_host()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    # the workspace of a failed build is kept so that it can be resumed from the failed command
+    def _resume_state_path(self, project_name):
+        return join(default_cache_dir, 'resume', re.sub('[^a-zA-Z0-9_.-]', '-', project_name) + '.json')
+
+    def _load_resume_state(self, project_name):
+        state_path = self._resume_state_path(project_name)
+        if not self._keep_failed or not os.path.exists(state_path):
+            return None, None
+        with open(state_path, 'r') as statefile:
+            state = json.load(statefile)
+        if self._resume and os.path.exists(state['work_dir']):
+            print('Resuming from command %d' % state['index'])
+            return state['work_dir'], state['index']
+        self._discard_resume_state(project_name)
+        return None, None
+
+    def _save_resume_state(self, project_name, work_dir, index):
+        state_path = self._resume_state_path(project_name)
+        if not os.path.exists(os.path.dirname(state_path)):
+            os.makedirs(os.path.dirname(state_path))
+        with open(state_path, 'w') as statefile:
+            json.dump({'work_dir': work_dir, 'index': index}, statefile)
+
+    def _discard_resume_state(self, project_name):
+        state_path = self._resume_state_path(project_name)
+        if not self._keep_failed or not os.path.exists(state_path):
+            return
+        with open(state_path, 'r') as statefile:
+            shutil.rmtree(json.load(statefile)['work_dir'], ignore_errors=True)
+        os.unlink(state_path)
 
 
 class CodebuildRun:
@@ -69,12 +239,18 @@ class CodebuildRun:
                  project,
                  input_src,
                  work_dir,
-                 sts_client=boto3.client('sts'),
+                 sts_client=None,
                  docker_version='auto',
                  assume_role=True,
                  debug=False,
                  override={},
-                 pull_image=False):
+                 pull_image=False,
+                 docker_cache=False,
+                 docker_cache_size=None,
+                 docker_pool=None,
+                 secondary_sources={},
+                 build_status=None,
+                 resume_from=None):
 
         self._project = project
         self._input_src = input_src
@@ -85,9 +261,24 @@ class CodebuildRun:
         self._debug = debug
         self._override = override
         self._pull_image = pull_image
+        self._docker_cache = docker_cache
+        self._docker_cache_size = docker_cache_size
+        self._docker_pool = docker_pool
+        self._secondary_sources = secondary_sources
+        self._build_status = build_status
+        self._log_line = ''
+        self._resume_from = resume_from
+        self._docker_host = None
+        self._docker_layer_cache = None
+        self._cache_report = None
+        self._container = None
+        self._docker_client = None
 
     def assume_role(self):
+        import boto3
         if self._assume_role:
+            if self._sts_client is None:
+                self._sts_client = boto3.client('sts')
             service_role = self._project['serviceRole']
             assume = self._sts_client.assume_role(RoleArn=service_role,
                                                   RoleSessionName='codebuild-emulator')
@@ -103,6 +294,8 @@ class CodebuildRun:
 
     def prepare_dirs(self):
         readonly = join(self._work_dir, 'codebuild', 'readonly')
+        # a resumed build gets fresh inputs but keeps its output
+        shutil.rmtree(readonly, ignore_errors=True)
         os.makedirs(readonly)
         self._readonly_dir = readonly
 
@@ -115,62 +308,153 @@ class CodebuildRun:
 
         src = join(readonly, 'src')
 
-        shutil.copytree(self._input_src, src)
+        copies = [(shutil.copytree, (self._input_src, src))]
+        if self._secondary_sources:
+            os.mkdir(join(readonly, 'sources'))
+        for name in self._secondary_sources:
+            copies.append((shutil.copytree, (self._secondary_sources[name], join(readonly, 'sources', name))))
+        run_parallel(copies)
 
         with open(join(readonly, 'variables.json'), 'w') as varsfile:
             vars = self._get_env_vars()
             json.dump(vars, varsfile)
 
+        self._write_buildspec()
+
+        output_dir = join(self._work_dir, 'codebuild', 'output')
+        if not os.path.exists(output_dir):
+            os.mkdir(output_dir)
+        self._output_dir = output_dir
+
+        self._debug_file = join(output_dir, 'debug')
+        if self._debug:
+            open(self._debug_file, 'a').close()
+
+
+    def _write_buildspec(self):
         buildspec = self._get_buildspec()
-        buildspec_dest = join(readonly, 'buildspec.yml')
+        buildspec_dest = join(self._readonly_dir, 'buildspec.yml')
 
         if buildspec.startswith('version: '):
             with open(buildspec_dest, 'w') as buildspecfile:
                 buildspecfile.write(buildspec)
         else:
-            buildspec_src = join(src, buildspec)
+            buildspec_src = join(self._readonly_dir, 'src', buildspec)
             if os.path.exists(buildspec_src):
                 shutil.copy2(buildspec_src, buildspec_dest)
             else:
                 raise Exception("No buildspec provided")
 
-        output_dir = join(self._work_dir, 'codebuild', 'output')
-        os.mkdir(output_dir)
-        self._output_dir = output_dir
-
-        self._debug_file = join(output_dir, 'debug')
-        if self._debug:
-            open(self._debug_file, 'a').close()
-
-
-    def run_container(self):
+    # paths are relative to input_src, they are passed to the executor that copies them, or removes
+    # them, in its source directory on its next run
+    def sync_sources(self, paths):
+        src = join(self._readonly_dir, 'src')
+        for path in sorted(paths):
+            source = join(self._input_src, path)
+            destination = join(src, path)
+            if os.path.isdir(destination) and not os.path.islink(destination):
+                shutil.rmtree(destination)
+            elif os.path.lexists(destination):
+                os.unlink(destination)
+            if not os.path.lexists(source):
+                continue
+            if not os.path.exists(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), destination)
+            elif os.path.isdir(source):
+                shutil.copytree(source, destination, symlinks=True)
+            else:
+                shutil.copy2(source, destination)
+        self._write_buildspec()
+
+        changed_path = join(self._output_dir, 'changed_sources')
+        changed = set(paths)
+        if os.path.exists(changed_path):
+            with open(changed_path, 'r') as changedfile:
+                changed.update(json.load(changedfile))
+        with open(changed_path, 'w') as changedfile:
+            json.dump(sorted(changed), changedfile)
+
+        if self._ships_files():
+            members = [(join(src, path), join('codebuild', 'readonly', 'src', path))
+                       for path in sorted(paths) if os.path.lexists(join(src, path))]
+            members.append((join(self._readonly_dir, 'buildspec.yml'), 'codebuild/readonly/buildspec.yml'))
+            members.append((changed_path, 'codebuild/output/changed_sources'))
+            self._put_archive(members)
+
+    # index of the first command of the phase, or of the next phase that has commands
+    def first_command_index(self, phase_name):
+        plan, results = self.read_results()
+        indexes = [step['index'] for step in plan
+                   if phase_names.index(step['phase']) >= phase_names.index(phase_name)]
+        if indexes:
+            return min(indexes)
+        return len(plan)
+
+    # keep_alive starts a container that only waits, the build is run in it by exec_executor
+    def run_container(self, keep_alive=False):
         image = self._project['environment']['image']
         volumes = {self._readonly_dir: {'bind': '/codebuild/readonly', 'mode': 'ro'},
                    self._output_dir: {'bind': '/codebuild/output', 'mode': 'rw'}}
         command = '/codebuild/readonly/bin/executor'
+        if keep_alive:
+            command = ['tail', '-f', '/dev/null']
         environment = {'AWS_ACCESS_KEY_ID': self._access_key_id,
                        'AWS_SECRET_ACCESS_KEY': self._secret_access_key,
                        'AWS_SESSION_TOKEN': self._session_token,
                        'AWS_DEFAULT_REGION': self._region_name,
                        'CBEMU_UID': os.getuid(),
                        'CBEMU_GID': os.getgid()}
+        if self._resume_from:
+            environment['CBEMU_RESUME_FROM'] = self._resume_from
 
         privileged_mode = self._project['environment']['privilegedMode'] or image.startswith('aws/codebuild/docker')
 
-        docker_client = docker.from_env(version=self._docker_version)
+        # docker wraps the connection errors of its version check in DockerException
+        if self._docker_pool:
+            self._docker_host = self._docker_pool.acquire(image)
+            docker_client = retry('docker_connect', self._docker_host.client, breaker=self._breaker(),
+                                  transient=any_error)
+        else:
+            import docker
+            docker_client = retry('docker_connect', docker.from_env, kwargs={'version': self._docker_version},
+                                  breaker=self._breaker(), transient=any_error)
+        self._docker_client = docker_client
 
         if self._pull_image:
             print('Pulling %s' % image)
-            docker_client.images.pull(name=image)
-
-        container = docker_client.containers.run(image=image,
-                                                 volumes=volumes,
-                                                 command=command,
-                                                 environment=environment,
-                                                 privileged=privileged_mode,
-                                                 tty=True,
-                                                 detach=True)
+            retry('docker_pull', docker_client.images.pull, kwargs={'name': image}, breaker=self._breaker())
+            if self._docker_host:
+                self._docker_host.image_pulled(image)
+
+        if self._ships_files():
+            if self._debug:
+                raise Exception("Debug mode needs a docker host with shared storage")
+            volumes = {}
+
+        if privileged_mode and self._use_docker_layer_cache():
+            self._docker_layer_cache = DockerLayerCache(docker_client, max_size=self._docker_cache_size)
+            self._docker_cache_volume = self._docker_layer_cache.acquire(self._project['name'])
+            self._cache_report = {'type': 'LOCAL_DOCKER_LAYER_CACHE',
+                                  'volume': self._docker_cache_volume,
+                                  'hit': self._docker_layer_cache.hit}
+            print('Using docker layer cache %s' % self._docker_cache_volume)
+            volumes[self._docker_cache_volume] = {'bind': '/var/lib/docker', 'mode': 'rw'}
+
+        # not retried, a failed call may still have created the container
+        container = self._breaker().call(docker_client.containers.create,
+                                        image=image,
+                                        volumes=volumes,
+                                        command=command,
+                                        environment=environment,
+                                        privileged=privileged_mode,
+                                        tty=True,
+                                        detach=True)
         self._container = container
+        if self._ships_files():
+            self._put_inputs()
+        self._breaker().call(container.start)
 
     def wait_for_container(self):
         if self._debug:
@@ -178,41 +462,250 @@ class CodebuildRun:
             run_thread.daemon = True
             run_thread.start()
 
+        since = None
+        attempt = 0
+        self._last_log_timestamp = None
+        self._last_log_written = 0
         while True:
-            stream = self._container.logs(stdout=True, stderr=True, stream=True, follow=True)
             try:
-                for c in stream:
-                    sys.stdout.write(c)
-                    sys.stdout.flush()
-                    if c == '\n':
-                        sys.stdout.write('[Container] ')
-                        sys.stdout.flush()
+                stream = self._container.logs(stdout=True, stderr=True, stream=True, follow=True, timestamps=True,
+                                              since=since)
+                self._write_timestamped_log(stream)
                 break
             except Exception as e:
+                # docker only takes whole seconds, the lines of that second already printed are skipped
+                if self._last_log_timestamp:
+                    since = calendar.timegm(time.strptime(self._last_log_timestamp[0], '%Y-%m-%dT%H:%M:%S'))
+                attempt += 1
+                if attempt > max_log_attempts:
+                    print('Giving up streaming logs: %s' % str(e))
+                    break
+                delay = backoff_delay(attempt, max_delay=10)
+                metrics.increment('docker_logs', 'retries')
                 print('\n' + '=' * 128)
                 print(str(e))
+                print('Streaming logs again in %.1fs' % delay)
                 print('\n' + '=' * 128)
+                time.sleep(delay)
 
+        if self._log_line:
+            self._write_log('\n')
 
         if self._debug:
             run_thread.join(timeout=10)
 
-        self._container.reload()
+        # the container is running, a breaker opened by other builds must not fail this one
+        retry('docker_reload', self._container.reload)
 
         while not self._container.status == 'exited':
             time.sleep(1)
+            retry('docker_reload', self._container.reload)
+
+        exit_code = self._container.attrs['State']['ExitCode']
 
-        docker_api = docker.APIClient(version=self._docker_version)
-        exit_code = docker_api.inspect_container(self._container.id)['State']['ExitCode']
+        if self._ships_files():
+            self._get_outputs()
         return exit_code
 
-    def copy_artifacts(self, artifacts_target_dir):
+    def exec_executor(self, resume_from=0):
+        api = self._docker_client.api
+        command = ['env', 'CBEMU_RESUME_FROM=%d' % resume_from, '/codebuild/readonly/bin/executor']
+        # the container is kept running between reruns, so like the calls below it does not fail fast on the breaker
+        execution = retry('docker_exec_create', api.exec_create, args=(self._container.id, command),
+                          kwargs={'tty': True})
+        for chunk in api.exec_start(execution['Id'], stream=True):
+            for c in chunk:
+                self._write_log(c)
+        if self._log_line:
+            self._write_log('\n')
+        exit_code = retry('docker_exec_inspect', api.exec_inspect, args=(execution['Id'],))['ExitCode']
+
+        if self._ships_files():
+            self._get_outputs()
+        return exit_code
+
+    def remove_container(self):
+        if self._container:
+            self._container.remove(force=True)
+            self._container = None
+
+    # strips the timestamp docker puts before each line. After a reconnect what was already printed is
+    # skipped, the lines older than the last one and the start of the last one when it was cut
+    def _write_timestamped_log(self, stream):
+        header = ''
+        in_line = False
+        skip = 0
+        current = False
+        replaying = self._last_log_timestamp is not None
+        for chunk in stream:
+            for c in chunk:
+                if not in_line:
+                    if c not in ' \n' and len(header) < max_log_timestamp_length:
+                        header += c
+                        continue
+                    in_line = True
+                    timestamp = parse_log_timestamp(header)
+                    skip = 0
+                    current = False
+                    if timestamp and replaying and timestamp < self._last_log_timestamp:
+                        skip = None
+                    elif timestamp and replaying and timestamp == self._last_log_timestamp:
+                        skip = self._last_log_written
+                        current = True
+                    elif timestamp:
+                        replaying = False
+                        self._last_log_timestamp = timestamp
+                        self._last_log_written = 0
+                        current = True
+                    if timestamp:
+                        header = ''
+                        if c == ' ':
+                            continue
+                    for h in header:
+                        self._write_log(h)
+                    header = ''
+                if c == '\n':
+                    in_line = False
+                if skip is None:
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                self._write_log(c)
+                if current:
+                    self._last_log_written += 1
+        for h in header:
+            self._write_log(h)
+
+    def _write_log(self, c):
+        if not self._build_status:
+            sys.stdout.write(c)
+            sys.stdout.flush()
+            if c == '\n':
+                sys.stdout.write('[Container] ')
+                sys.stdout.flush()
+            return
+
+        # whole lines prefixed with the job id so that concurrent builds do not mix on stdout
+        self._log_line += c
+        lines = self._log_line.split('\n')
+        self._log_line = lines.pop()
+        # progress bars only redraw with \r, a line that does not end is cut
+        if len(self._log_line) >= max_line_length:
+            lines.append(self._log_line)
+            self._log_line = ''
+        for line in lines:
+            line = line.rstrip('\r')
+            sys.stdout.write('[%s] %s\n' % (self._build_status.job_id, line))
+            sys.stdout.flush()
+            self._build_status.append_line(line)
+
+    # each daemon of a pool has its own breaker, so that one unreachable daemon does not stop the others
+    def _breaker(self):
+        if self._docker_host:
+            return self._docker_host.breaker
+        return docker_breaker
+
+    def release_docker_host(self):
+        if self._docker_host:
+            self._docker_pool.release(self._docker_host)
+            self._docker_host = None
+
+    def _ships_files(self):
+        return self._docker_host is not None and not self._docker_host.shared_storage
+
+    def _put_inputs(self):
+        self._put_archive([(self._readonly_dir, 'codebuild/readonly'), (self._output_dir, 'codebuild/output')])
+
+    # members are (path, name in the container) pairs, the tar is streamed from a temporary file.
+    # Like the other calls on a created container it does not fail fast on the breaker
+    def _put_archive(self, members):
+        with tempfile.TemporaryFile() as archive:
+            with tarfile.open(fileobj=archive, mode='w') as tar:
+                for path, arcname in members:
+                    tar.add(path, arcname=arcname)
+
+            def put_archive():
+                archive.seek(0)
+                return self._container.put_archive('/', archive)
+            retry('docker_put_archive', put_archive)
+
+    def _get_outputs(self):
+        stream, stat = retry('docker_get_archive', self._container.get_archive, args=('/codebuild/output',))
+        with tempfile.TemporaryFile() as archive:
+            if hasattr(stream, 'read'):
+                shutil.copyfileobj(stream, archive)
+            else:
+                for chunk in stream:
+                    archive.write(chunk)
+            archive.seek(0)
+            with tarfile.open(fileobj=archive, mode='r') as tar:
+                tar.extractall(join(self._work_dir, 'codebuild'))
+
+    def release_docker_cache(self):
+        if not self._docker_layer_cache:
+            return
+        # the exited container would keep a reference on the volume and prevent pruning it
+        if self._container:
+            self._container.remove(force=True)
+        self._docker_layer_cache.release(self._docker_cache_volume)
+        self._docker_layer_cache.prune()
+        self._docker_layer_cache = None
+
+    def read_report(self):
+        report_path = join(self._output_dir, 'report.json')
+        report = {'phases': [], 'artifacts': []}
+        if os.path.exists(report_path):
+            with open(report_path, 'r') as reportfile:
+                report = json.load(reportfile)
+        report['cache'] = self._cache_report
+        report['failed_command'] = self.failed_step()
+        return report
+
+    def read_results(self):
+        plan = []
+        plan_path = join(self._output_dir, 'plan.json')
+        if os.path.exists(plan_path):
+            with open(plan_path, 'r') as planfile:
+                plan = json.load(planfile)
+        results = []
+        results_path = join(self._output_dir, 'results')
+        if os.path.exists(results_path):
+            with open(results_path, 'r') as resultsfile:
+                results = [json.loads(line) for line in resultsfile if line.strip()]
+        return plan, results
+
+    def _failed_steps(self):
+        plan, results = self.read_results()
+        steps = dict((step['index'], step) for step in plan)
+        return [steps[index] for index, rc, duration in results if rc and index in steps]
+
+    # the first failed command that aborted its phase, the commands after it in the phase did not run
+    def aborted_step(self):
+        for step in self._failed_steps():
+            if step['block'] == 'commands' and step.get('on_failure', 'ABORT') != 'CONTINUE':
+                return step
+        return None
+
+    # the failed command that ended the build: the one that aborted its phase, otherwise the last
+    # failure, for example of a finally command or of a phase with on-failure CONTINUE
+    def failed_step(self):
+        failed = self._failed_steps()
+        return self.aborted_step() or (failed[-1] if failed else None)
+
+    def copy_artifacts(self, artifacts_target_dir, secondary_target_dir=None):
         artifacts_source_dir = join(self._output_dir, 'artifacts')
         if os.path.exists(artifacts_source_dir):
             print("Artifacts are copied into " + artifacts_target_dir)
             shutil.rmtree(artifacts_target_dir, ignore_errors=True)
             shutil.copytree(artifacts_source_dir, artifacts_target_dir)
 
+        secondary_source_dir = join(self._output_dir, 'secondary_artifacts')
+        if secondary_target_dir and os.path.exists(secondary_source_dir):
+            print("Secondary artifacts are copied into " + secondary_target_dir)
+            shutil.rmtree(secondary_target_dir, ignore_errors=True)
+            shutil.copytree(secondary_source_dir, secondary_target_dir)
+
     def _get_buildspec(self):
         if 'buildspec' in self._project['source']:
             buildspec_raw = self._project['source']['buildspec'].strip()
@@ -220,6 +713,10 @@ class CodebuildRun:
         else:
             return 'buildspec.yml'
 
+    def _use_docker_layer_cache(self):
+        cache = self._project.get('cache') or {}
+        return self._docker_cache or 'LOCAL_DOCKER_LAYER_CACHE' in cache.get('modes', [])
+
     def _get_env_vars(self):
         raw_environment = self._project['environment']['environmentVariables']
         environment = {}
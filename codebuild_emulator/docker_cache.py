@@ -0,0 +1,94 @@
+import os
+from os.path import join
+import fcntl
+import re
+
+default_cache_dir = join(os.path.expanduser('~'), '.cbemu')
+cache_label = 'codebuild-emulator.docker-layer-cache'
+
+
+# One named volume per project mounted on /var/lib/docker of privileged builds.
+# Only one build at a time may use a volume since two docker daemons can not share
+# /var/lib/docker, the lock files mtime also tells which volume was least recently used
+class DockerLayerCache:
+
+    def __init__(self, docker_client, cache_dir=default_cache_dir, max_size=None):
+        self._docker_client = docker_client
+        self._lock_dir = join(cache_dir, 'locks')
+        self._max_size = max_size
+        self._locks = {}
+        self.hit = False
+        if not os.path.exists(self._lock_dir):
+            os.makedirs(self._lock_dir)
+
+    def volume_name(self, project_name):
+        return 'cbemu-docker-cache-' + re.sub('[^a-zA-Z0-9_.-]', '-', project_name)
+
+    def acquire(self, project_name):
+        name = self.volume_name(project_name)
+        lock_file = open(self._lock_path(name), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            print('Waiting for docker layer cache %s used by another build' % name)
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        os.utime(self._lock_path(name), None)
+        self._locks[name] = lock_file
+
+        # the name filter also matches the volumes whose name contains this one
+        volumes = self._docker_client.volumes.list(filters={'name': name})
+        self.hit = any(volume.name == name for volume in volumes)
+        if not self.hit:
+            print('Creating docker layer cache %s' % name)
+            self._docker_client.volumes.create(name=name, labels={cache_label: project_name})
+        return name
+
+    def release(self, name):
+        lock_file = self._locks.pop(name, None)
+        if lock_file:
+            os.utime(self._lock_path(name), None)
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+    def prune(self):
+        if self._max_size is None:
+            return []
+
+        sizes = {}
+        for volume in self._docker_client.df().get('Volumes') or []:
+            if cache_label in (volume.get('Labels') or {}):
+                sizes[volume['Name']] = max(volume.get('UsageData', {}).get('Size', 0), 0)
+
+        total = sum(sizes.values())
+        removed = []
+        for name in sorted(sizes, key=self._last_used):
+            if total <= self._max_size:
+                break
+            if not self._try_remove(name):
+                continue
+            total -= sizes[name]
+            removed.append(name)
+            print('Pruned docker layer cache %s' % name)
+        return removed
+
+    def _try_remove(self, name):
+        with open(self._lock_path(name), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return False
+            try:
+                self._docker_client.volumes.get(name).remove()
+            except Exception as e:
+                print('Could not remove docker layer cache %s: %s' % (name, str(e)))
+                return False
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+    def _last_used(self, name):
+        lock_path = self._lock_path(name)
+        return os.path.getmtime(lock_path) if os.path.exists(lock_path) else 0
+
+    def _lock_path(self, name):
+        return join(self._lock_dir, name + '.lock')
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from resilience import CircuitBreaker
+
+# a daemon found without an image, or unreachable, is asked again after this many seconds
+missing_image_check_interval = 60
+
+
+# A docker daemon builds can be sent to, weight is the number of builds it can run at the same time.
+# shared_storage means the daemon sees the same paths as this machine so bind mounts can be used,
+# otherwise inputs and outputs are shipped with put_archive and get_archive
+class DockerHost:
+
+    def __init__(self, url, weight=1, tls=None, shared_storage=False, docker_version='auto', client=None):
+        self.url = url
+        self.weight = weight
+        self.shared_storage = shared_storage
+        self.running = 0
+        self._tls = tls
+        self._docker_version = docker_version
+        self._client = client
+        self._images = set()
+        self._missing_images = {}
+        self.breaker = CircuitBreaker('docker %s' % url)
+
+    def client(self):
+        if self._client is None:
+            import docker
+            tls = False
+            if self._tls:
+                tls = docker.tls.TLSConfig(client_cert=(self._tls['cert'], self._tls['key']),
+                                           ca_cert=self._tls.get('ca'),
+                                           verify=self._tls.get('verify', True))
+            self._client = docker.DockerClient(base_url=self.url, tls=tls, version=self._docker_version)
+        return self._client
+
+    def has_image(self, image):
+        if image in self._images:
+            return True
+        if self.breaker.is_open() or \
+                time.time() - self._missing_images.get(image, 0) < missing_image_check_interval:
+            return False
+        try:
+            self.breaker.call(lambda: self.client().images.get(image))
+        except Exception:
+            self._missing_images[image] = time.time()
+            return False
+        self._images.add(image)
+        return True
+
+    def image_pulled(self, image):
+        self._images.add(image)
+        self._missing_images.pop(image, None)
+
+    def load(self):
+        return float(self.running) / self.weight
+
+
+class DockerHostPool:
+
+    def __init__(self, hosts):
+        self._hosts = hosts
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_file(cls, path, docker_version='auto'):
+        with open(path, 'r') as hostsfile:
+            config = json.load(hostsfile)
+        hosts = [DockerHost(host['url'],
+                            weight=host.get('weight', 1),
+                            tls=host.get('tls'),
+                            shared_storage=host.get('shared_storage', False),
+                            docker_version=docker_version)
+                 for host in config]
+        if not hosts:
+            raise Exception("No docker host configured in %s" % path)
+        return cls(hosts)
+
+    # daemons whose breaker is open get no builds
+    def acquire(self, image):
+        # asking the daemons is slow when one of them is, so it is done without holding the lock
+        cached = set(host for host in self._hosts if host.has_image(image))
+        with self._condition:
+            while True:
+                available = [host for host in self._hosts
+                             if host.running < host.weight and not host.breaker.is_open()]
+                if available:
+                    break
+                # a breaker closes again without anything notifying
+                self._condition.wait(1)
+            # least loaded daemon, the ones that already have the image first
+            host = min(available, key=lambda host: (host not in cached, host.load()))
+            host.running += 1
+        print('Running %s on docker host %s' % (image, host.url))
+        return host
+
+    def wait_until_available(self, poll_interval=1):
+        if all(host.breaker.is_open() for host in self._hosts):
+            print('No docker host is healthy, waiting for one to recover')
+        while all(host.breaker.is_open() for host in self._hosts):
+            time.sleep(poll_interval)
+
+    def release(self, host):
+        with self._condition:
+            host.running -= 1
+            self._condition.notify()
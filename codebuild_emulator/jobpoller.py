@@ -10,37 +10,71 @@ import time
 import threading
 from os.path import join
 from botocore.client import Config
+from resilience import retry, backoff_delay, s3_breaker
+from codebuild_emulator import run_parallel
 
 
 class JobPoller:
 
-    def __init__(self, action_type_id, builder):
+    def __init__(self, action_type_id, builder, codepipeline_client=None, max_builds=4, registry=None):
         self._action_type_id = action_type_id
-        self._codepipeline = boto3.client('codepipeline')
+        self._registry = registry
+        self._codepipeline = codepipeline_client or boto3.client('codepipeline')
         self._builder = builder
+        self._build_slots = threading.BoundedSemaphore(max_builds)
 
     def poll(self):
+        failures = 0
+        while True:
+            try:
+                self.poll_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                delay = backoff_delay(failures, max_delay=60)
+                print('Polling failed (%s), polling again in %.1fs' % (str(e), delay))
+                time.sleep(delay)
+
+    def poll_once(self):
+        # only take a job when it can be run, otherwise leave it to other pollers
+        self._build_slots.acquire()
+        try:
+            job = self._wait_for_job()
+            job_id = job['id']
+            print("Job with id %s found" % job_id)
+
+            # acknowledging with the same nonce twice is harmless
+            retry('acknowledge_job', self._codepipeline.acknowledge_job,
+                  kwargs={'jobId': job_id, 'nonce': job['nonce']})
+        except:
+            self._build_slots.release()
+            raise
+
+        threading.Thread(target=self._run_build, args=(job,)).start()
+
+    def _wait_for_job(self):
         jobs = []
         print("Polling for jobs %s" % self._action_type_id)
         while not jobs:
             time.sleep(2)
-            response = self._codepipeline.poll_for_jobs(actionTypeId=self._action_type_id, maxBatchSize=1)
+            self._builder.wait_for_docker()
+            s3_breaker.wait_until_closed()
+            response = retry('poll_for_jobs', self._codepipeline.poll_for_jobs,
+                             kwargs={'actionTypeId': self._action_type_id, 'maxBatchSize': 1},
+                             attempts=10)
             jobs = response['jobs']
+        return jobs[0]
 
-        job = jobs[0]
-
-        job_id = job['id']
-        print("Job with id %s found" % job_id)
-
-        nonce = job['nonce']
-        self._codepipeline.acknowledge_job(jobId=job_id, nonce=nonce)
-
-        threading.Thread(target=self._build, args=(job,)).start()
-        self.poll()
+    def _run_build(self, job):
+        try:
+            self._build(job)
+        finally:
+            self._build_slots.release()
 
 
     def _build(self, job):
         job_id = job['id']
+        build_status = None
 
         try:
            artifactCredentials = job['data']['artifactCredentials']
@@ -50,52 +84,98 @@ class JobPoller:
                aws_session_token=artifactCredentials['sessionToken'])
 
            s3 = s3session.client('s3', config=Config(signature_version='s3v4'))
-           bucketName = job['data']['inputArtifacts'][0]['location']['s3Location']['bucketName']
-           objectKey = job['data']['inputArtifacts'][0]['location']['s3Location']['objectKey']
 
            tempdir = tempfile.mkdtemp()
            print('tempdir for job %s is %s' % (job_id, tempdir))
 
-           input_src = join(tempdir, 'input')
-           os.mkdir(input_src)
-           target = join(tempdir, 'output')
-           os.mkdir(target)
-
-           print('Downloading artifact %s from bucket %s' % (objectKey, bucketName))
-           s3.download_file(bucketName, objectKey, join(tempdir, 'input.zip'))
-
-           with ZipFileWithPermissions(join(tempdir, 'input.zip'), 'r') as zip:
-               zip.extractall(input_src)
-
            configuration = job['data']['actionConfiguration']['configuration']
            print('Using configuration %s' % configuration)
 
-           print("Building job %s" % job_id)
-           #Run build
-           rc = self._builder.run(configuration=configuration, input_src=input_src, target_dir=target)
+           # the first input artifact is the primary source unless PrimarySource says otherwise,
+           # the others are secondary sources named after their artifact
+           input_artifacts = job['data']['inputArtifacts']
+           primary_source = configuration.get('PrimarySource', input_artifacts[0]['name'])
+           input_dirs = dict((artifact['name'], join(tempdir, 'input', artifact['name']))
+                             for artifact in input_artifacts)
+           run_parallel([(self._download_artifact, (s3, artifact, input_dirs[artifact['name']]))
+                         for artifact in input_artifacts])
+           input_src = input_dirs.pop(primary_source)
 
-           shutil.make_archive(join(tempdir, 'output'), 'zip', target)
-
-           uploadBucket = job['data']['outputArtifacts'][0]['location']['s3Location']['bucketName']
-           uploadKey = job['data']['outputArtifacts'][0]['location']['s3Location']['objectKey']
+           target = join(tempdir, 'output')
+           secondary_target = join(tempdir, 'secondary_output')
 
-           print('Uploading artifact %s to bucket %s' % (uploadKey, uploadBucket))
-           s3.upload_file(join(tempdir, 'output.zip'), uploadBucket, uploadKey)
+           print("Building job %s" % job_id)
+           if self._registry:
+               build_status = self._registry.start(job_id, configuration.get('ProjectName'))
+           #Run build
+           rc = self._builder.run(configuration=configuration, input_src=input_src, target_dir=target,
+                                  secondary_sources=input_dirs, secondary_target_dir=secondary_target,
+                                  build_status=build_status)
+
+           # an output artifact gets the secondary artifact with the same name, the first one
+           # gets the primary artifacts otherwise
+           upload_dir = join(tempdir, 'upload')
+           os.mkdir(upload_dir)
+           uploads = []
+           for index, artifact in enumerate(job['data'].get('outputArtifacts', [])):
+               artifact_dir = join(secondary_target, artifact['name'])
+               if not os.path.exists(artifact_dir):
+                   artifact_dir = target if index == 0 else None
+               if artifact_dir:
+                   uploads.append((self._upload_artifact, (s3, artifact, artifact_dir, upload_dir)))
+               else:
+                   print('No secondary artifact %s in the buildspec' % artifact['name'])
+           run_parallel(uploads)
 
            if not rc == 0:
                print('job %s failed with return code %d' % (job_id, rc))
-               self._codepipeline.put_job_failure_result(jobId=job_id, failureDetails={'type': 'JobFailed', 'message': 'Failed'})
+               self._put_job_failure_result(job_id)
            else:
-               self._codepipeline.put_job_success_result(jobId=job_id, executionDetails={'summary': 'It worked'})
+               retry('put_job_success_result', self._codepipeline.put_job_success_result,
+                     kwargs={'jobId': job_id, 'executionDetails': {'summary': 'It worked'}})
                print('job %s succeeded' % job_id)
+           # only once the job result is known to CodePipeline
+           if build_status:
+               build_status.finish(rc)
 
            shutil.rmtree(tempdir)
            print("Done with " + job_id)
 
         except:
-           self._codepipeline.put_job_failure_result(jobId=job_id, failureDetails={'type': 'JobFailed', 'message': 'Failed'})
+           if build_status and build_status.state == 'IN_PROGRESS':
+               build_status.finish(-1)
+           self._put_job_failure_result(job_id)
            raise
 
+    def _download_artifact(self, s3, artifact, input_dir):
+        bucketName = artifact['location']['s3Location']['bucketName']
+        objectKey = artifact['location']['s3Location']['objectKey']
+        archive = input_dir + '.zip'
+        os.makedirs(input_dir)
+
+        print('Downloading artifact %s from bucket %s' % (objectKey, bucketName))
+        retry('download_file', s3.download_file, args=(bucketName, objectKey, archive),
+              breaker=s3_breaker)
+
+        with ZipFileWithPermissions(archive, 'r') as zip:
+            zip.extractall(input_dir)
+
+    def _upload_artifact(self, s3, artifact, artifact_dir, upload_dir):
+        uploadBucket = artifact['location']['s3Location']['bucketName']
+        uploadKey = artifact['location']['s3Location']['objectKey']
+        if not os.path.exists(artifact_dir):
+            os.makedirs(artifact_dir)
+
+        archive = shutil.make_archive(join(upload_dir, artifact['name']), 'zip', artifact_dir)
+
+        print('Uploading artifact %s to bucket %s' % (uploadKey, uploadBucket))
+        retry('upload_file', s3.upload_file, args=(archive, uploadBucket, uploadKey),
+              breaker=s3_breaker)
+
+    def _put_job_failure_result(self, job_id):
+        retry('put_job_failure_result', self._codepipeline.put_job_failure_result,
+              kwargs={'jobId': job_id, 'failureDetails': {'type': 'JobFailed', 'message': 'Failed'}})
+
 
 # ZipFile should keep permissions
 class ZipFileWithPermissions(ZipFile):
@@ -0,0 +1,158 @@
+import errno
+import random
+import socket
+import threading
+import time
+
+transient_errnos = set([errno.ECONNREFUSED, errno.ECONNRESET, errno.ECONNABORTED, errno.ETIMEDOUT, errno.EPIPE,
+                        errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EAGAIN])
+transient_error_codes = set(['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestLimitExceeded',
+                             'TooManyRequestsException', 'RequestThrottled', 'SlowDown', 'RequestTimeout',
+                             'RequestTimeoutException', 'InternalError', 'ServiceUnavailable'])
+transient_error_classes = set(['EndpointConnectionError', 'ConnectTimeoutError', 'ReadTimeoutError',
+                               'ConnectionClosedError'])
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# Counts the retries, failures and circuit breaker trips per operation
+class RetryMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def increment(self, operation, counter):
+        with self._lock:
+            counters = self._counters.setdefault(operation, {'retries': 0, 'failures': 0, 'trips': 0})
+            counters[counter] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict((operation, dict(counters)) for operation, counters in self._counters.items())
+
+
+metrics = RetryMetrics()
+
+
+# Connection errors, timeouts, 5xx and throttling, the errors worth retrying and that tell a service
+# is unhealthy. A 404 or an access denied is an answer and fails at once
+def is_transient(error):
+    response = getattr(error, 'response', None)
+    # botocore ClientError
+    if isinstance(response, dict) and 'Error' in response:
+        status = response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return status >= 500 or status == 429 or response['Error'].get('Code') in transient_error_codes
+    # docker APIError and requests HTTPError
+    status = getattr(response, 'status_code', None)
+    if status is not None:
+        return status >= 500 or status == 429
+    if isinstance(error, (socket.timeout, socket.error)):
+        return True
+    if any(cls.__name__ in transient_error_classes for cls in type(error).__mro__):
+        return True
+    # requests ConnectionError and Timeout are IOErrors without errno
+    if isinstance(error, EnvironmentError):
+        return error.errno is None or error.errno in transient_errnos
+    return False
+
+
+def any_error(error):
+    return True
+
+
+# Stops calling an unhealthy service after failure_threshold consecutive transient failures,
+# one call is let through again after reset_timeout seconds to probe it
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None and time.time() - self._opened_at < self._reset_timeout
+
+    def wait_until_closed(self, poll_interval=1):
+        if self.is_open():
+            print('%s is unhealthy, waiting for it to recover' % self.name)
+        while self.is_open():
+            time.sleep(poll_interval)
+
+    def call(self, func, *args, **kwargs):
+        self.check()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_transient(e):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def check(self):
+        if self.is_open():
+            raise CircuitOpenError('%s is unhealthy' % self.name)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._failure_threshold:
+                if self._opened_at is None:
+                    print('Circuit breaker for %s is open' % self.name)
+                    metrics.increment(self.name, 'trips')
+                self._opened_at = time.time()
+
+
+docker_breaker = CircuitBreaker('docker')
+s3_breaker = CircuitBreaker('s3')
+
+
+def backoff_delay(attempt, base_delay=1, max_delay=30):
+    # full jitter: uniform between 0 and the exponential delay
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# Calls func until it succeeds, only use it for idempotent calls. Only the errors transient(error)
+# is true for are retried, and a call that gives up on them is one failure for the breaker
+def retry(operation, func, args=(), kwargs=None, attempts=5, base_delay=1, max_delay=30,
+          breaker=None, transient=is_transient):
+    kwargs = kwargs or {}
+    attempt = 0
+    if breaker:
+        try:
+            breaker.check()
+        except CircuitOpenError:
+            metrics.increment(operation, 'failures')
+            raise
+    while True:
+        try:
+            result = func(*args, **kwargs)
+            if breaker:
+                breaker.record_success()
+            return result
+        except Exception as e:
+            attempt += 1
+            if not transient(e):
+                metrics.increment(operation, 'failures')
+                raise
+            if attempt >= attempts:
+                metrics.increment(operation, 'failures')
+                if breaker:
+                    breaker.record_failure()
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            metrics.increment(operation, 'retries')
+            print('%s failed (%s), retrying in %.1fs' % (operation, str(e), delay))
+            time.sleep(delay)
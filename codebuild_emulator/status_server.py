@@ -0,0 +1,149 @@
+import collections
+import json
+import re
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+max_log_lines = 1000
+max_line_length = 4096
+max_finished_builds = 20
+phase_pattern = re.compile(r'^Running phase (\w+)')
+
+
+# Status and last log lines of one build. Appending never blocks, readers that are too slow
+# just miss the lines that fell out of the ring buffer
+class BuildStatus:
+
+    def __init__(self, job_id, project):
+        self.job_id = job_id
+        self.project = project
+        self.phase = None
+        self.state = 'IN_PROGRESS'
+        self.start = time.time()
+        self.end = None
+        self._lines = collections.deque(maxlen=max_log_lines)
+        self._sequence = 0
+        self._condition = threading.Condition()
+
+    def append_line(self, line):
+        line = line.rstrip('\r\n')[:max_line_length]
+        match = phase_pattern.match(line)
+        with self._condition:
+            if match:
+                self.phase = match.group(1)
+            self._sequence += 1
+            self._lines.append((self._sequence, line))
+            self._condition.notify_all()
+
+    def finish(self, exit_code):
+        with self._condition:
+            self.state = 'SUCCEEDED' if exit_code == 0 else 'FAILED'
+            self.end = time.time()
+            self._condition.notify_all()
+
+    def lines_after(self, sequence, timeout=None):
+        with self._condition:
+            if timeout and self._sequence <= sequence and self.state == 'IN_PROGRESS':
+                self._condition.wait(timeout)
+            return [(number, line) for number, line in self._lines if number > sequence]
+
+    def describe(self):
+        return {'job_id': self.job_id,
+                'project': self.project,
+                'phase': self.phase,
+                'state': self.state,
+                'elapsed': (self.end or time.time()) - self.start}
+
+
+class BuildRegistry:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._builds = collections.OrderedDict()
+
+    def start(self, job_id, project):
+        status = BuildStatus(job_id, project)
+        with self._lock:
+            self._builds[job_id] = status
+            finished = [build for build in self._builds.values() if build.state != 'IN_PROGRESS']
+            for build in finished[:max(len(finished) - max_finished_builds, 0)]:
+                del self._builds[build.job_id]
+        return status
+
+    def get(self, job_id):
+        with self._lock:
+            return self._builds.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._builds.values())
+
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        registry = self.server.registry
+        path = self.path.split('?')[0].rstrip('/')
+        parts = path.split('/')[1:]
+
+        if parts == ['jobs']:
+            return self._send_json([build.describe() for build in registry.list()])
+
+        build = registry.get(parts[1]) if len(parts) >= 2 and parts[0] == 'jobs' else None
+        if not build:
+            return self.send_error(404)
+        if len(parts) == 2:
+            return self._send_json(build.describe())
+        if parts[2:] == ['logs']:
+            if 'text/event-stream' in self.headers.get('Accept', ''):
+                return self._stream_logs(build)
+            return self._send_text('\n'.join(line for number, line in build.lines_after(0)) + '\n')
+        self.send_error(404)
+
+    def _send_json(self, value):
+        self._send_text(json.dumps(value), 'application/json')
+
+    def _send_text(self, text, content_type='text/plain'):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    # server-sent events, a reconnecting client resumes from Last-Event-ID
+    def _stream_logs(self, build):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        sequence = int(self.headers.get('Last-Event-ID', 0))
+        while True:
+            lines = build.lines_after(sequence, timeout=15)
+            for sequence, line in lines:
+                self.wfile.write('id: %d\ndata: %s\n\n' % (sequence, line))
+            if not lines:
+                if build.state != 'IN_PROGRESS':
+                    self.wfile.write('event: end\ndata: %s\n\n' % build.state)
+                    return
+                # keeps the connection alive and notices clients that went away
+                self.wfile.write(': %s\n\n' % build.phase)
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StatusServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, registry):
+        HTTPServer.__init__(self, address, StatusRequestHandler)
+        self.registry = registry
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print('Build status on http://%s:%d/jobs' % self.server_address)
@@ -0,0 +1,98 @@
+import os
+from os.path import join
+import sys
+import shutil
+import tempfile
+import time
+from fnmatch import fnmatchcase
+from codebuild_builder import ArtifactMatcher
+
+# Matches artifact patterns over a synthetic tree and checks the files found against a simple
+# segment by segment matcher, and the time against a bare walk of the tree.
+# python benchmark_artifacts.py [number of files], default 120000
+
+cases = [(['**/*'], []),
+         (['**/target/*.jar'], ['**/*-sources.jar']),
+         (['module-1*/target/**/*.class'], []),
+         (['*/src/main/**/File1?.java', 'docs/**'], ['docs/tmp/**']),
+         (['README.md', '*/pom.xml'], [])]
+max_walk_ratio = 3
+
+
+def create_tree(root, files):
+    paths = ['README.md', 'docs/index.html', 'docs/tmp/draft.html']
+    module = 0
+    while len(paths) < files:
+        name = 'module-%d' % module
+        paths.append(name + '/pom.xml')
+        paths.append(name + '/target/%s.jar' % name)
+        paths.append(name + '/target/%s-sources.jar' % name)
+        for package in range(10):
+            for number in range(20):
+                paths.append('%s/src/main/java/pkg%d/File%d.java' % (name, package, number))
+                paths.append('%s/target/classes/pkg%d/File%d.class' % (name, package, number))
+            paths.append('%s/node_modules/dep%d/.npmignore' % (name, package))
+        module += 1
+    for path in paths:
+        directory = os.path.dirname(join(root, path))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        open(join(root, path), 'a').close()
+    return paths
+
+
+def reference_match(pattern, path):
+    return match_segments(pattern.split('/'), path.split('/'))
+
+
+def match_segments(patterns, names):
+    if not patterns:
+        return not names
+    if patterns[0] == '**':
+        if len(patterns) == 1:
+            return len(names) > 0
+        return any(match_segments(patterns[1:], names[position:]) for position in range(len(names)))
+    return bool(names) and fnmatchcase(names[0], patterns[0]) and match_segments(patterns[1:], names[1:])
+
+
+def bare_walk(root):
+    paths = []
+    for directory, dirs, files in os.walk(root):
+        paths.extend(join(directory, name) for name in files)
+    return paths
+
+
+def main(files):
+    root = tempfile.mkdtemp()
+    failed = False
+    try:
+        start = time.time()
+        paths = create_tree(root, files)
+        print('Created %d files in %.1fs' % (len(paths), time.time() - start))
+
+        start = time.time()
+        bare_walk(root)
+        walk_time = time.time() - start
+        print('Bare walk %.3fs' % walk_time)
+
+        for patterns, exclude in cases:
+            start = time.time()
+            found = set(ArtifactMatcher(patterns, exclude).walk(root))
+            match_time = time.time() - start
+
+            expected = set(path for path in paths
+                           if any(reference_match(pattern, path) for pattern in patterns)
+                           and not any(reference_match(pattern, path) for pattern in exclude))
+            correct = found == expected
+            fast = match_time <= max_walk_ratio * walk_time
+            failed = failed or not correct or not fast
+            print('%-60s %7d files %.3fs %s%s' % (' '.join(patterns + ['-' + pattern for pattern in exclude]),
+                                                  len(found), match_time,
+                                                  '' if correct else ' WRONG (%d expected)' % len(expected),
+                                                  '' if fast else ' SLOW'))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return failed
+
+if __name__ == '__main__':
+    sys.exit(1 if main(int(sys.argv[1]) if len(sys.argv) > 1 else 120000) else 0)
@@ -0,0 +1,64 @@
+import unittest
+import os
+from os.path import join
+import shutil
+import time
+from build_history import BuildHistory, percentile
+
+
+class TestBuildHistory(unittest.TestCase):
+
+    def _prepare_test(self):
+        this_dir = os.path.dirname(os.path.realpath(__file__))
+        history_dir = join(this_dir, 'tmp', 'history')
+        shutil.rmtree(history_dir, ignore_errors=True)
+        return BuildHistory(history_dir), history_dir
+
+    def _report(self, start, build_duration):
+        return {'project': 'my/project',
+                'start': start,
+                'exit_code': 0,
+                'phases': [{'name': 'install', 'duration': 1.0},
+                           {'name': 'build', 'duration': build_duration}]}
+
+    def test_append_and_load(self):
+        print 'test_append_and_load'
+        history, history_dir = self._prepare_test()
+        now = time.time()
+        history.append(self._report(now, 2.0))
+        history.append(self._report(now - 86400 * 10, 3.0))
+
+        day = time.strftime('%Y-%m-%d', time.gmtime(now))
+        self.assertTrue(os.path.exists(join(history_dir, 'my-project', day + '.jsonl')))
+
+        reports = history.load('my/project')
+        self.assertEqual([report['phases'][1]['duration'] for report in reports], [3.0, 2.0])
+        self.assertEqual(len(history.load('my/project', days=5)), 1)
+        self.assertEqual(history.load('other-project'), [])
+
+    def test_phase_stats(self):
+        print 'test_phase_stats'
+        history, history_dir = self._prepare_test()
+        reports = [self._report(start, duration) for start, duration in
+                   enumerate([10.0, 10.0, 10.0, 10.0, 20.0, 20.0, 20.0, 20.0])]
+        stats = history.phase_stats(reports)
+
+        self.assertEqual([phase['phase'] for phase in stats], ['install', 'build'])
+        self.assertEqual(stats[0]['trend'], 0)
+        build = stats[1]
+        self.assertEqual(build['runs'], 8)
+        self.assertEqual(build['p50'], 10.0)
+        self.assertEqual(build['p95'], 20.0)
+        self.assertEqual(build['last'], 20.0)
+        self.assertEqual(build['trend'], 1.0)
+
+    def test_percentile(self):
+        print 'test_percentile'
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 95), 3)
+
+if __name__ == '__main__':
+    unittest.main()
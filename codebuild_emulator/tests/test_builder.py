@@ -1,10 +1,11 @@
 import unittest
 import shutil
 import os
-from codebuild_builder import CodebuildBuilder
+from codebuild_builder import CodebuildBuilder, ArtifactMatcher
 from os.path import join
 import threading
 import time
+import json
 
 class TestBuilder(unittest.TestCase):
 
@@ -127,6 +128,216 @@ class TestBuilder(unittest.TestCase):
             print expected_file_path
             self.assertTrue(os.path.exists(expected_file_path))
 
+    def test_report(self):
+        print 'test_report'
+        output_dir, readonly_dir = self._prepare_test('bad')
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        try:
+            builder.run()
+        except Exception:
+            pass
+
+        with open(join(output_dir, 'report.json'), 'r') as reportfile:
+            report = json.load(reportfile)
+
+        self.assertFalse(report['succeeded'])
+        self.assertEqual([phase['name'] for phase in report['phases']],
+                         ['install', 'pre_build', 'build', 'post_build'])
+        self.assertEqual([phase['status'] for phase in report['phases']],
+                         ['SUCCEEDED', 'SUCCEEDED', 'FAILED', 'SUCCEEDED'])
+        build_commands = report['phases'][2]['commands']
+        self.assertEqual(build_commands[-1]['command'], 'false')
+        self.assertNotEqual(build_commands[-1]['exit_code'], 0)
+        self.assertTrue(all('duration' in phase for phase in report['phases']))
+
+        artifacts = dict((artifact['path'], artifact) for artifact in report['artifacts'])
+        self.assertEqual(artifacts['source.foo']['size'], os.path.getsize(join(readonly_dir, 'src', 'source.foo')))
+        self.assertEqual(len(artifacts['source.foo']['sha256']), 64)
+
+    def test_secondary_sources_and_artifacts(self):
+        print 'test_secondary_sources_and_artifacts'
+        output_dir, readonly_dir = self._prepare_test('multi')
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        builder.run()
+
+        output_src = join(output_dir, 'src123456789')
+        self.assertTrue(os.path.exists(join(output_dir, 'src_lib', 'lib.foo')))
+        with open(join(output_dir, 'artifacts', 'primary'), 'r') as primary:
+            self.assertEqual(primary.readlines(), [output_src + '\n'])
+
+        secondary_dir = join(output_dir, 'secondary_artifacts')
+        self.assertEqual(sorted(os.listdir(secondary_dir)), ['app', 'lib'])
+        self.assertTrue(os.path.exists(join(secondary_dir, 'lib', 'lib.copy')))
+        self.assertTrue(os.listdir(join(secondary_dir, 'app')))
+
+        with open(join(output_dir, 'report.json'), 'r') as reportfile:
+            report = json.load(reportfile)
+        self.assertEqual(sorted(artifact.get('artifact') for artifact in report['artifacts']),
+                         [None, 'app', 'lib'])
+
+    def test_finally_and_on_failure(self):
+        print 'test_finally_and_on_failure'
+        output_dir, readonly_dir = self._prepare_test('phases')
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        self.assertRaises(Exception, builder.run)
+
+        output_src = join(output_dir, 'src123456789')
+        self.assertEqual(sorted(name for name in os.listdir(output_src) if name != 'source.foo'),
+                         ['build_finally', 'install_finally', 'post_build', 'pre_build'])
+
+        with open(join(output_dir, 'plan.json'), 'r') as planfile:
+            plan = json.load(planfile)
+        self.assertEqual([(step['index'], step['phase'], step['block']) for step in plan],
+                         [(0, 'install', 'commands'), (1, 'install', 'commands'), (2, 'install', 'finally'),
+                          (3, 'pre_build', 'commands'), (4, 'build', 'commands'), (5, 'build', 'commands'),
+                          (6, 'build', 'finally'), (7, 'post_build', 'commands')])
+        with open(join(output_dir, 'results'), 'r') as resultsfile:
+            results = [json.loads(line) for line in resultsfile]
+        self.assertEqual([(index, rc == 0) for index, rc, duration in results],
+                         [(0, False), (2, True), (3, True), (4, False), (6, True), (7, True)])
+
+    def test_resume(self):
+        print 'test_resume'
+        output_dir, readonly_dir = self._prepare_test('phases')
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        self.assertRaises(Exception, builder.run)
+
+        # the failed build command is fixed in the kept workspace
+        output_src = join(output_dir, 'src123456789')
+        open(join(output_src, 'fixed'), 'a').close()
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False,
+                                   resume_from=4)
+        builder.run()
+
+        self.assertTrue(os.path.exists(join(output_src, 'build')))
+        with open(join(output_dir, 'results'), 'r') as resultsfile:
+            results = [json.loads(line) for line in resultsfile]
+        self.assertEqual([(index, rc) for index, rc, duration in results], [(4, 0), (5, 0), (6, 0), (7, 0)])
+
+    def test_artifact_matcher(self):
+        print 'test_artifact_matcher'
+        matcher = ArtifactMatcher(['target/**/*.jar', '*.txt', 'docs/**', 'v?[!x].md'], ['**/*-sources.jar'])
+        for path in ['target/app.jar', 'target/lib/deep/lib.jar', 'notes.txt', '.hidden.txt', 'docs/a/b.html',
+                     'v1a.md']:
+            self.assertTrue(matcher.matches(path), path)
+        for path in ['target/app-sources.jar', 'src/target/app.jar', 'src/notes.txt', 'target/app.war',
+                     'docs', 'v1x.md']:
+            self.assertFalse(matcher.matches(path), path)
+
+    def test_upload_artifact_patterns(self):
+        print 'test_upload_artifact_patterns'
+        output_dir, readonly_dir = self._prepare_test()
+        builder = CodebuildBuilder(input_dir=readonly_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        builder._prepare_output()
+        for path in ['target/app.jar', 'target/lib/lib.jar', 'target/lib/lib-sources.jar', 'src/main.java']:
+            if not os.path.exists(os.path.dirname(join(builder._src, path))):
+                os.makedirs(os.path.dirname(join(builder._src, path)))
+            open(join(builder._src, path), 'a').close()
+
+        builder._upload_artifact({'files': ['**/*.jar'], 'base-directory': 'target',
+                                  'exclude-paths': ['**/*-sources.jar']}, join(output_dir, 'jars'), None)
+        builder._upload_artifact({'files': ['target/**/*'], 'discard-paths': 'yes'}, join(output_dir, 'flat'), None)
+
+        self.assertEqual(sorted(artifact['path'] for artifact in builder._report['artifacts'][:2]),
+                         ['app.jar', 'lib/lib.jar'])
+        self.assertTrue(os.path.exists(join(output_dir, 'jars', 'lib', 'lib.jar')))
+        self.assertEqual(sorted(os.listdir(join(output_dir, 'flat'))), ['app.jar', 'lib-sources.jar', 'lib.jar'])
+
+    def test_rerun_from_earlier_phase(self):
+        print 'test_rerun_from_earlier_phase'
+        output_dir, readonly_dir = self._prepare_test('rerun')
+        # whole build, again from build, again from the start
+        for resume_from in [0, 1, 0]:
+            CodebuildBuilder(input_dir=readonly_dir,
+                             output_dir=output_dir,
+                             debug=False,
+                             resume_from=resume_from).run()
+
+        output_src = join(output_dir, 'src123456789')
+        with open(join(output_src, 'state.log'), 'r') as statelog:
+            self.assertEqual(statelog.readlines(), ['x %s\n' % join(output_src, 'sub')] * 3)
+
+    def test_changed_sources(self):
+        print 'test_changed_sources'
+        output_dir, readonly_dir = self._prepare_test()
+        input_dir = join(os.path.dirname(output_dir), 'input')
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.copytree(readonly_dir, input_dir)
+        source = join(input_dir, 'src', 'source.foo')
+        with open(source, 'w') as sourcefile:
+            sourcefile.write('v1\n')
+        builder = CodebuildBuilder(input_dir=input_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        builder._prepare_output()
+        open(join(builder._src, 'gone.foo'), 'a').close()
+
+        # same size and mtime, only the list of changed paths tells it apart
+        stat = os.stat(source)
+        with open(source, 'w') as sourcefile:
+            sourcefile.write('v2\n')
+        os.utime(source, (stat.st_atime, stat.st_mtime))
+        with open(join(output_dir, 'changed_sources'), 'w') as changedfile:
+            json.dump(['source.foo', 'gone.foo'], changedfile)
+        builder._prepare_output()
+
+        with open(join(builder._src, 'source.foo'), 'r') as sourcefile:
+            self.assertEqual(sourcefile.read(), 'v2\n')
+        self.assertFalse(os.path.exists(join(builder._src, 'gone.foo')))
+        self.assertFalse(os.path.exists(join(output_dir, 'changed_sources')))
+
+    def test_hyphenated_source_name(self):
+        print 'test_hyphenated_source_name'
+        output_dir, readonly_dir = self._prepare_test()
+        input_dir = join(os.path.dirname(output_dir), 'input')
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.copytree(readonly_dir, input_dir)
+        os.makedirs(join(input_dir, 'sources', 'my-lib'))
+        open(join(input_dir, 'sources', 'my-lib', 'lib.foo'), 'a').close()
+        builder = CodebuildBuilder(input_dir=input_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        builder.run()
+
+        self.assertTrue(builder._succeeded)
+        with open(join(output_dir, 'tmp', 'env.sh'), 'r') as envsh:
+            env = envsh.read()
+        self.assertTrue('CODEBUILD_SRC_DIR_my_lib=' in env)
+        self.assertTrue(join(output_dir, 'src_my-lib') in env)
+
+    @unittest.skipIf(os.getuid() != 0, 'su needs root')
+    def test_run_as(self):
+        print 'test_run_as'
+        output_dir, readonly_dir = self._prepare_test()
+        input_dir = join(os.path.dirname(output_dir), 'input')
+        shutil.rmtree(input_dir, ignore_errors=True)
+        shutil.copytree(readonly_dir, input_dir)
+        with open(join(input_dir, 'buildspec.yml'), 'w') as buildspec:
+            buildspec.write('version: 0.2\nrun-as: root\nphases:\n  build:\n    commands:\n      - export ran_as=$(id -u)\n')
+        builder = CodebuildBuilder(input_dir=input_dir,
+                                   output_dir=output_dir,
+                                   debug=False)
+        builder.run()
+
+        self.assertTrue(builder._succeeded)
+        envsh = join(output_dir, 'tmp', 'env.sh')
+        with open(envsh, 'r') as envshfile:
+            self.assertTrue("ran_as='0'" in envshfile.read())
+        self.assertEqual(os.stat(envsh).st_mode & 0o077, 0)
+        self.assertEqual(os.stat(envsh).st_uid, os.getuid())
+
     def test_debug_run(self):
         print 'test_debug_run'
         output_dir, readonly_dir = self._prepare_test()
@@ -0,0 +1,124 @@
+import unittest
+import os
+from os.path import join
+import shutil
+import threading
+import time
+from docker_cache import DockerLayerCache, cache_label
+
+
+class TestDockerCache(unittest.TestCase):
+
+    def _prepare_test(self):
+        this_dir = os.path.dirname(os.path.realpath(__file__))
+        cache_dir = join(this_dir, 'tmp', 'cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+        return cache_dir
+
+    def test_acquire_creates_volume(self):
+        print 'test_acquire_creates_volume'
+        cache_dir = self._prepare_test()
+        client = DockerClientMock()
+        cache = DockerLayerCache(client, cache_dir=cache_dir)
+        name = cache.acquire('my/project')
+        self.assertEqual(name, 'cbemu-docker-cache-my-project')
+        self.assertEqual(client.volumes.created, {name: {cache_label: 'my/project'}})
+        cache.release(name)
+
+        cache.acquire('my/project')
+        self.assertEqual(len(client.volumes.created), 1)
+
+    def test_acquire_matches_exact_name(self):
+        print 'test_acquire_matches_exact_name'
+        cache_dir = self._prepare_test()
+        client = DockerClientMock()
+        client.volumes.create('cbemu-docker-cache-app-v2', {cache_label: 'app-v2'})
+        cache = DockerLayerCache(client, cache_dir=cache_dir)
+        name = cache.acquire('app')
+        self.assertFalse(cache.hit)
+        self.assertEqual(client.volumes.created[name], {cache_label: 'app'})
+
+    def test_acquire_waits_for_release(self):
+        print 'test_acquire_waits_for_release'
+        cache_dir = self._prepare_test()
+        first = DockerLayerCache(DockerClientMock(), cache_dir=cache_dir)
+        second = DockerLayerCache(DockerClientMock(), cache_dir=cache_dir)
+        name = first.acquire('project')
+
+        acquired = []
+        waiting_thread = threading.Thread(target=lambda: acquired.append(second.acquire('project')))
+        waiting_thread.start()
+        time.sleep(0.5)
+        self.assertEqual(acquired, [])
+
+        first.release(name)
+        waiting_thread.join(timeout=10)
+        self.assertEqual(acquired, [name])
+        second.release(name)
+
+    def test_prune_least_recently_used(self):
+        print 'test_prune_least_recently_used'
+        cache_dir = self._prepare_test()
+        client = DockerClientMock()
+        cache = DockerLayerCache(client, cache_dir=cache_dir, max_size=250)
+        for project in ['old', 'locked', 'new']:
+            cache.release(cache.acquire(project))
+            client.volumes.sizes[cache.volume_name(project)] = 100
+        os.utime(join(cache_dir, 'locks', 'cbemu-docker-cache-old.lock'), (1, 1))
+        os.utime(join(cache_dir, 'locks', 'cbemu-docker-cache-locked.lock'), (0, 0))
+
+        locked = cache.acquire('locked')
+        self.assertEqual(cache.prune(), ['cbemu-docker-cache-old'])
+        self.assertEqual(client.volumes.removed, ['cbemu-docker-cache-old'])
+        cache.release(locked)
+
+    def test_no_prune_without_budget(self):
+        print 'test_no_prune_without_budget'
+        cache_dir = self._prepare_test()
+        client = DockerClientMock()
+        cache = DockerLayerCache(client, cache_dir=cache_dir)
+        cache.release(cache.acquire('project'))
+        client.volumes.sizes[cache.volume_name('project')] = 100
+        self.assertEqual(cache.prune(), [])
+
+
+class DockerClientMock:
+    def __init__(self):
+        self.volumes = VolumesMock()
+
+    def df(self):
+        return {'Volumes': [{'Name': name,
+                             'Labels': labels,
+                             'UsageData': {'Size': self.volumes.sizes.get(name, 0)}}
+                            for name, labels in self.volumes.created.items()]}
+
+
+class VolumesMock:
+    def __init__(self):
+        self.created = {}
+        self.sizes = {}
+        self.removed = []
+
+    # like docker, the name filter matches part of the name
+    def list(self, filters):
+        return [VolumeMock(self, name) for name in self.created if filters['name'] in name]
+
+    def create(self, name, labels):
+        self.created[name] = labels
+
+    def get(self, name):
+        return VolumeMock(self, name)
+
+
+class VolumeMock:
+    def __init__(self, volumes, name):
+        self._volumes = volumes
+        self.name = name
+
+    def remove(self):
+        del self._volumes.created[self.name]
+        self._volumes.removed.append(self.name)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import unittest
+import os
+from os.path import join
+import json
+import shutil
+import tarfile
+import io
+import threading
+import time
+from docker_pool import DockerHost, DockerHostPool
+from codebuild_emulator import CodebuildRun
+from resilience import docker_breaker
+from test_emulator import Boto3Mock, assume_role_response, test_project
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+
+class TestDockerPool(unittest.TestCase):
+
+    def setUp(self):
+        # other tests may have opened it while no docker daemon is running
+        docker_breaker.record_success()
+
+    def _prepare_test(self):
+        input_src = join(this_dir, 'data', 'input', 'good', 'src')
+        work_dir = join(this_dir, 'tmp', 'work')
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        return input_src, work_dir
+
+    def test_prefers_host_with_image(self):
+        print 'test_prefers_host_with_image'
+        empty = DockerHost('tcp://empty:2376', weight=4, client=DockerClientMock())
+        cached = DockerHost('tcp://cached:2376', weight=1, client=DockerClientMock(images=['my-image']))
+        pool = DockerHostPool([empty, cached])
+
+        self.assertEqual(pool.acquire('my-image'), cached)
+        # cached is full, the build goes to the other one
+        self.assertEqual(pool.acquire('my-image'), empty)
+        self.assertEqual(pool.acquire('other-image'), empty)
+
+    def test_least_loaded_by_weight(self):
+        print 'test_least_loaded_by_weight'
+        small = DockerHost('tcp://small:2376', weight=1, client=DockerClientMock())
+        big = DockerHost('tcp://big:2376', weight=3, client=DockerClientMock())
+        pool = DockerHostPool([small, big])
+
+        hosts = [pool.acquire('image') for i in range(4)]
+        self.assertEqual(hosts.count(big), 3)
+        self.assertEqual(hosts.count(small), 1)
+
+    def test_waits_for_capacity(self):
+        print 'test_waits_for_capacity'
+        host = DockerHost('tcp://host:2376', weight=1, client=DockerClientMock())
+        pool = DockerHostPool([host])
+        pool.acquire('image')
+
+        acquired = []
+        waiting_thread = threading.Thread(target=lambda: acquired.append(pool.acquire('image')))
+        waiting_thread.start()
+        time.sleep(0.5)
+        self.assertEqual(acquired, [])
+        pool.release(host)
+        waiting_thread.join(timeout=10)
+        self.assertEqual(acquired, [host])
+
+    def test_slow_host_does_not_block_release(self):
+        print 'test_slow_host_does_not_block_release'
+        fast = DockerHost('tcp://fast:2376', weight=1, client=DockerClientMock(images=['image']))
+        slow = DockerHost('tcp://slow:2376', weight=1, client=DockerClientMock(delay=2))
+        pool = DockerHostPool([fast, slow])
+        fast.running = 1
+
+        acquired = []
+        acquiring_thread = threading.Thread(target=lambda: acquired.append(pool.acquire('image')))
+        acquiring_thread.start()
+        time.sleep(0.2)
+        start = time.time()
+        pool.release(fast)
+        self.assertTrue(time.time() - start < 1)
+        acquiring_thread.join(timeout=10)
+        self.assertEqual(acquired, [fast])
+
+    def test_skips_unhealthy_host(self):
+        print 'test_skips_unhealthy_host'
+        dead = DockerHost('tcp://dead:2376', weight=4, client=DockerClientMock(images=['image']))
+        alive = DockerHost('tcp://alive:2376', weight=1, client=DockerClientMock())
+        pool = DockerHostPool([dead, alive])
+        for i in range(3):
+            dead.breaker.record_failure()
+
+        self.assertEqual(pool.acquire('image'), alive)
+        # the other daemons and the process wide docker breaker are not affected
+        self.assertFalse(alive.breaker.is_open())
+        self.assertFalse(docker_breaker.is_open())
+        pool.wait_until_available()
+
+    def test_from_file(self):
+        print 'test_from_file'
+        input_src, work_dir = self._prepare_test()
+        hosts_file = join(work_dir, 'hosts.json')
+        with open(hosts_file, 'w') as hostsfile:
+            json.dump([{'url': 'tcp://a:2376', 'weight': 2},
+                       {'url': 'unix:///var/run/docker.sock', 'shared_storage': True}], hostsfile)
+        pool = DockerHostPool.from_file(hosts_file)
+        self.assertEqual([(host.url, host.weight, host.shared_storage) for host in pool._hosts],
+                         [('tcp://a:2376', 2, False), ('unix:///var/run/docker.sock', 1, True)])
+
+    def test_run_ships_files(self):
+        print 'test_run_ships_files'
+        input_src, work_dir = self._prepare_test()
+        client = DockerClientMock(images=['codebuild-emulator-test'])
+        pool = DockerHostPool([DockerHost('tcp://remote:2376', client=client)])
+        run = CodebuildRun(test_project, input_src, work_dir, Boto3Mock(assume_role_response),
+                           docker_pool=pool)
+        run.assume_role()
+        run.prepare_dirs()
+        run.run_container()
+
+        container = client.containers.created
+        self.assertEqual(container.create_kwargs['volumes'], {})
+        self.assertTrue('codebuild/readonly/bin/executor' in container.put_names)
+        self.assertTrue('codebuild/readonly/src/source.foo' in container.put_names)
+        self.assertTrue(container.streamed)
+
+        exit_code = run.wait_for_container()
+        run.release_docker_host()
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(pool._hosts[0].running, 0)
+        with open(join(work_dir, 'codebuild', 'output', 'artifacts', 'build'), 'r') as artifact:
+            self.assertEqual(artifact.read(), 'build\n')
+
+
+class DockerClientMock:
+    def __init__(self, images=(), delay=0):
+        self.images = ImagesMock(images, delay)
+        self.containers = ContainersMock()
+
+
+class ImagesMock:
+    def __init__(self, images, delay=0):
+        self._images = images
+        self._delay = delay
+
+    def get(self, name):
+        time.sleep(self._delay)
+        if name not in self._images:
+            raise Exception('No such image')
+        return name
+
+
+class ContainersMock:
+    def __init__(self):
+        self.created = None
+
+    def create(self, **kwargs):
+        self.created = ContainerMock(kwargs)
+        return self.created
+
+
+class ContainerMock:
+    def __init__(self, create_kwargs):
+        self.create_kwargs = create_kwargs
+        self.put_names = []
+        self.status = 'created'
+        self.attrs = {'State': {'ExitCode': 0}}
+
+    def put_archive(self, path, data):
+        # streamed from a file, not loaded in memory
+        self.streamed = hasattr(data, 'read')
+        with tarfile.open(fileobj=data, mode='r') as tar:
+            self.put_names = tar.getnames()
+        return True
+
+    def start(self):
+        self.status = 'running'
+
+    def logs(self, **kwargs):
+        return iter('done\n')
+
+    def reload(self):
+        self.status = 'exited'
+
+    def get_archive(self, path):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as tar:
+            info = tarfile.TarInfo('output/artifacts/build')
+            info.size = len('build\n')
+            tar.addfile(info, io.BytesIO('build\n'))
+        archive.seek(0)
+        return archive, {}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ import json
 import shutil
 from codebuild_emulator import CodebuildEmulator
 from codebuild_emulator import CodebuildRun
+from status_server import BuildStatus, max_line_length
+from codebuild_builder import CodebuildBuilder
 
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
@@ -57,6 +59,67 @@ class TestEmulator(unittest.TestCase):
             variables = json.load(variables_file)
         self.assertDictEqual(variables, {"TEST_ENV_VAR_1": "foo", "TEST_ENV_VAR_2": "bar"})
 
+    def test_prepare_dirs_secondary_sources(self):
+        print 'test_prepare_dirs_secondary_sources'
+        input_src, work_dir, artifacts_dir = self._prepare_test()
+        lib_src = join(this_dir, 'data', 'input', 'multi', 'sources', 'lib')
+        run = CodebuildRun(test_project, input_src, work_dir, secondary_sources={'lib': lib_src})
+        run.prepare_dirs()
+        self.assertTrue(os.path.exists(join(work_dir, 'codebuild', 'readonly', 'src', 'source.foo')))
+        self.assertTrue(os.path.exists(join(work_dir, 'codebuild', 'readonly', 'sources', 'lib', 'lib.foo')))
+
+    def test_write_log_with_build_status(self):
+        print 'test_write_log_with_build_status'
+        status = BuildStatus('job-id', 'my-project')
+        run = CodebuildRun(test_project, None, None, build_status=status)
+        for c in 'Running phase build\r\nhello\r\nwor':
+            run._write_log(c)
+        self.assertEqual(status.phase, 'build')
+        self.assertEqual([line for number, line in status.lines_after(0)], ['Running phase build', 'hello'])
+
+    def test_write_log_without_newline(self):
+        print 'test_write_log_without_newline'
+        status = BuildStatus('job-id', 'my-project')
+        run = CodebuildRun(test_project, None, None, build_status=status)
+        for i in range(1000):
+            for c in '\r%3d%%' % (i % 100):
+                run._write_log(c)
+        self.assertTrue(len(run._log_line) < max_line_length)
+        self.assertEqual(len(status.lines_after(0)), 1)
+
+    def test_failed_step(self):
+        print 'test_failed_step'
+        input_src, work_dir, artifacts_dir = self._prepare_test()
+        run = CodebuildRun(test_project, input_src, work_dir)
+        run.prepare_dirs()
+        output_dir = join(work_dir, 'codebuild', 'output')
+        with open(join(output_dir, 'plan.json'), 'w') as planfile:
+            json.dump([{'index': 0, 'phase': 'build', 'block': 'commands', 'command': 'make'},
+                       {'index': 1, 'phase': 'build', 'block': 'finally', 'command': 'make clean'}], planfile)
+        self.assertEqual(run.failed_step(), None)
+        with open(join(output_dir, 'results'), 'w') as resultsfile:
+            resultsfile.write('[0, 2, 1200]\n[1, 0, 10]\n')
+        self.assertEqual(run.failed_step()['command'], 'make')
+        self.assertEqual(run.read_report()['failed_command']['index'], 0)
+
+        # a resumed build keeps its output
+        CodebuildRun(test_project, input_src, work_dir, resume_from=0).prepare_dirs()
+        self.assertTrue(os.path.exists(join(output_dir, 'results')))
+
+    def test_failed_step_after_on_failure_continue(self):
+        print 'test_failed_step_after_on_failure_continue'
+        input_src, work_dir, artifacts_dir = self._prepare_test()
+        run = CodebuildRun(test_project, input_src, work_dir)
+        run.prepare_dirs()
+        builder = CodebuildBuilder(input_dir=join(this_dir, 'data', 'input', 'phases'),
+                                   output_dir=join(work_dir, 'codebuild', 'output'),
+                                   debug=False)
+        self.assertRaises(Exception, builder.run)
+        # install failed first but went on, the build stopped in the build phase
+        self.assertEqual(run.failed_step()['index'], 4)
+        self.assertEqual(run.failed_step()['command'], 'test -f fixed')
+        self.assertEqual(run.aborted_step()['index'], 4)
+
     # requires docker image codebuild-emulator-test built from the provided Dockerfile
     def test_run_container(self):
         print 'test_run_container'
@@ -0,0 +1,103 @@
+import unittest
+import os
+from os.path import join
+import zipfile
+import jobpoller
+from jobpoller import JobPoller
+from status_server import BuildRegistry
+
+
+def s3_location(name):
+    return {'name': name, 'location': {'s3Location': {'bucketName': 'bucket', 'objectKey': name + '.zip'}}}
+
+job = {'id': 'job-id',
+       'data': {'artifactCredentials': {'accessKeyId': 'a', 'secretAccessKey': 's', 'sessionToken': 't'},
+                'actionConfiguration': {'configuration': {'ProjectName': 'my-project', 'PrimarySource': 'App'}},
+                'inputArtifacts': [s3_location('Lib'), s3_location('App')],
+                'outputArtifacts': [s3_location('Out'), s3_location('Docs')]}}
+
+
+class TestJobPoller(unittest.TestCase):
+
+    def setUp(self):
+        self._boto3 = jobpoller.boto3
+        self._s3 = S3Mock()
+        jobpoller.boto3 = Boto3Mock(self._s3)
+
+    def tearDown(self):
+        jobpoller.boto3 = self._boto3
+
+    def test_build_multiple_artifacts(self):
+        print 'test_build_multiple_artifacts'
+        builder = BuilderMock()
+        codepipeline = CodepipelineMock()
+        poller = JobPoller({}, builder, codepipeline_client=codepipeline)
+        poller._build(job)
+
+        self.assertEqual(builder.sources, {'primary': ['App.txt'], 'Lib': ['Lib.txt']})
+        self.assertEqual(sorted(self._s3.uploaded), [('Docs.zip', ['docs.txt']), ('Out.zip', ['primary.txt'])])
+        self.assertEqual(codepipeline.results, ['success'])
+
+    def test_failed_upload_finishes_status(self):
+        print 'test_failed_upload_finishes_status'
+        self._s3.fail_uploads = True
+        codepipeline = CodepipelineMock()
+        registry = BuildRegistry()
+        poller = JobPoller({}, BuilderMock(), codepipeline_client=codepipeline, registry=registry)
+        self.assertRaises(ValueError, poller._build, job)
+
+        self.assertEqual(codepipeline.results, ['failure'])
+        self.assertEqual(registry.get('job-id').state, 'FAILED')
+
+
+class Boto3Mock:
+    def __init__(self, s3):
+        self._s3 = s3
+
+    def Session(self, **kwargs):
+        return self
+
+    def client(self, name, config=None):
+        return self._s3
+
+
+class S3Mock:
+    def __init__(self):
+        self.uploaded = []
+        self.fail_uploads = False
+
+    def download_file(self, bucket, key, path):
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.writestr(key.replace('.zip', '.txt'), key)
+
+    def upload_file(self, path, bucket, key):
+        if self.fail_uploads:
+            raise ValueError('upload refused')
+        with zipfile.ZipFile(path, 'r') as archive:
+            self.uploaded.append((key, sorted(archive.namelist())))
+
+
+class BuilderMock:
+    def run(self, configuration, input_src, target_dir, secondary_sources, secondary_target_dir, build_status):
+        self.sources = {'primary': os.listdir(input_src)}
+        for name in secondary_sources:
+            self.sources[name] = os.listdir(secondary_sources[name])
+        os.makedirs(target_dir)
+        open(join(target_dir, 'primary.txt'), 'a').close()
+        os.makedirs(join(secondary_target_dir, 'Docs'))
+        open(join(secondary_target_dir, 'Docs', 'docs.txt'), 'a').close()
+        return 0
+
+
+class CodepipelineMock:
+    def __init__(self):
+        self.results = []
+
+    def put_job_success_result(self, jobId, executionDetails):
+        self.results.append('success')
+
+    def put_job_failure_result(self, jobId, failureDetails):
+        self.results.append('failure')
+
+if __name__ == '__main__':
+    unittest.main()
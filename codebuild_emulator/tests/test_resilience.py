@@ -0,0 +1,156 @@
+import unittest
+import threading
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, RetryMetrics, retry, backoff_delay, is_transient
+from jobpoller import JobPoller
+
+
+class TestResilience(unittest.TestCase):
+
+    def setUp(self):
+        resilience.metrics = RetryMetrics()
+        self._sleep = resilience.time.sleep
+        resilience.time.sleep = lambda seconds: None
+
+    def tearDown(self):
+        resilience.time.sleep = self._sleep
+
+    def test_backoff_delay(self):
+        print 'test_backoff_delay'
+        for attempt in range(10):
+            delay = backoff_delay(attempt, base_delay=1, max_delay=30)
+            self.assertTrue(0 <= delay <= min(30, 2 ** attempt))
+
+    def test_retry_until_success(self):
+        print 'test_retry_until_success'
+        call = FailingCall(failures=2)
+        self.assertEqual(retry('flaky', call), 'done')
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(resilience.metrics.snapshot(), {'flaky': {'retries': 2, 'failures': 0, 'trips': 0}})
+
+    def test_retry_gives_up(self):
+        print 'test_retry_gives_up'
+        call = FailingCall(failures=10)
+        self.assertRaises(IOError, retry, 'flaky', call, attempts=3)
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(resilience.metrics.snapshot()['flaky']['failures'], 1)
+
+    def test_circuit_breaker(self):
+        print 'test_circuit_breaker'
+        breaker = CircuitBreaker('service', failure_threshold=2, reset_timeout=60)
+        call = FailingCall(failures=10)
+        self.assertRaises(IOError, breaker.call, call)
+        self.assertFalse(breaker.is_open())
+        self.assertRaises(IOError, breaker.call, call)
+        self.assertTrue(breaker.is_open())
+        self.assertRaises(CircuitOpenError, breaker.call, call)
+        self.assertEqual(call.calls, 2)
+        self.assertEqual(resilience.metrics.snapshot()['service']['trips'], 1)
+
+        breaker.record_success()
+        self.assertFalse(breaker.is_open())
+
+    def test_circuit_breaker_half_open(self):
+        print 'test_circuit_breaker_half_open'
+        breaker = CircuitBreaker('service', failure_threshold=1, reset_timeout=0)
+        call = FailingCall(failures=1)
+        self.assertRaises(IOError, breaker.call, call)
+        # reset_timeout elapsed, the next call probes the service
+        self.assertEqual(breaker.call(call), 'done')
+        self.assertFalse(breaker.is_open())
+
+    def test_retry_does_not_call_open_circuit(self):
+        print 'test_retry_does_not_call_open_circuit'
+        breaker = CircuitBreaker('service', failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        call = FailingCall(failures=0)
+        self.assertRaises(CircuitOpenError, retry, 'op', call, breaker=breaker)
+        self.assertEqual(call.calls, 0)
+
+    def test_retry_counts_one_breaker_failure(self):
+        print 'test_retry_counts_one_breaker_failure'
+        breaker = CircuitBreaker('service', failure_threshold=3, reset_timeout=60)
+        call = FailingCall(failures=10)
+        self.assertRaises(IOError, retry, 'flaky', call, attempts=5, breaker=breaker)
+        self.assertEqual(call.calls, 5)
+        self.assertFalse(breaker.is_open())
+
+    def test_retry_permanent_error(self):
+        print 'test_retry_permanent_error'
+        breaker = CircuitBreaker('service', failure_threshold=1, reset_timeout=60)
+        call = FailingCall(failures=10, error=HTTPErrorMock(404))
+        self.assertRaises(HTTPErrorMock, retry, 'pull', call, breaker=breaker)
+        self.assertEqual(call.calls, 1)
+        self.assertFalse(breaker.is_open())
+        self.assertRaises(HTTPErrorMock, breaker.call, call)
+        self.assertFalse(breaker.is_open())
+
+    def test_is_transient(self):
+        print 'test_is_transient'
+        self.assertTrue(is_transient(IOError('connection reset')))
+        self.assertFalse(is_transient(IOError(2, 'No such file or directory')))
+        self.assertTrue(is_transient(HTTPErrorMock(503)))
+        self.assertFalse(is_transient(HTTPErrorMock(404)))
+        self.assertTrue(is_transient(ClientErrorMock('ThrottlingException', 400)))
+        self.assertTrue(is_transient(ClientErrorMock('InternalError', 500)))
+        self.assertFalse(is_transient(ClientErrorMock('AccessDenied', 403)))
+        self.assertFalse(is_transient(ClientErrorMock('NoSuchKey', 404)))
+        self.assertFalse(is_transient(ValueError('bad value')))
+
+    def test_poller_acknowledges_with_retry(self):
+        print 'test_poller_acknowledges_with_retry'
+        codepipeline = CodepipelineMock()
+        poller = JobPoller({}, None, codepipeline_client=codepipeline, max_builds=1)
+        built = threading.Event()
+        poller._build = lambda job: built.set()
+        poller._wait_for_job = lambda: {'id': 'job-id', 'nonce': 'nonce'}
+
+        poller.poll_once()
+        built.wait(10)
+        self.assertEqual(codepipeline.acknowledged, [('job-id', 'nonce')] * 2)
+        # the build slot is released when the build is done
+        self.assertTrue(poller._build_slots.acquire(False))
+
+
+class FailingCall:
+    def __init__(self, failures, error=None):
+        self._failures = failures
+        self._error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self._failures:
+            raise self._error or IOError('failure %d' % self.calls)
+        return 'done'
+
+
+class ResponseMock:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+# like docker's APIError, a requests HTTPError
+class HTTPErrorMock(IOError):
+    def __init__(self, status_code):
+        IOError.__init__(self, 'HTTP %d' % status_code)
+        self.response = ResponseMock(status_code)
+
+
+class ClientErrorMock(Exception):
+    def __init__(self, code, status_code):
+        Exception.__init__(self, code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status_code}}
+
+
+class CodepipelineMock:
+    def __init__(self):
+        self.acknowledged = []
+
+    def acknowledge_job(self, jobId, nonce):
+        self.acknowledged.append((jobId, nonce))
+        if len(self.acknowledged) == 1:
+            raise IOError('throttled')
+
+if __name__ == '__main__':
+    unittest.main()
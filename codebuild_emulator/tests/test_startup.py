@@ -0,0 +1,46 @@
+import unittest
+import os
+from os.path import join
+import subprocess
+import sys
+import time
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(os.path.dirname(this_dir))
+
+# loose enough for slow machines, test_import_is_lazy is the strict check
+max_startup_seconds = 0.5
+
+
+class TestStartup(unittest.TestCase):
+
+    def _run(self, args):
+        env = dict(os.environ)
+        env['PYTHONPATH'] = root_dir
+        # no region configured must not break the CLI
+        env.pop('AWS_DEFAULT_REGION', None)
+        env.pop('AWS_REGION', None)
+        start = time.time()
+        process = subprocess.Popen([sys.executable] + args, cwd=root_dir, env=env,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = process.communicate()
+        elapsed = time.time() - start
+        self.assertEqual(process.returncode, 0, err)
+        return out, elapsed
+
+    def test_import_is_lazy(self):
+        print 'test_import_is_lazy'
+        out, elapsed = self._run(['-c', 'import sys, codebuild_emulator; '
+                                        'print(",".join(m for m in ["boto3", "botocore", "docker", "yaml"] '
+                                        'if m in sys.modules))'])
+        self.assertEqual(out.strip(), '')
+
+    def test_help_startup_time(self):
+        print 'test_help_startup_time'
+        out, elapsed = self._run([join(root_dir, 'bin', 'cbemu'), '--help'])
+        print 'cbemu --help took %.3fs' % elapsed
+        self.assertTrue('developer' in out)
+        self.assertTrue(elapsed < max_startup_seconds, 'cbemu --help took %.3fs' % elapsed)
+
+if __name__ == '__main__':
+    unittest.main()
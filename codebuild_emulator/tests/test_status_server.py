@@ -0,0 +1,81 @@
+import unittest
+import json
+import threading
+import urllib2
+import httplib
+import status_server
+from status_server import BuildRegistry, BuildStatus, StatusServer
+
+
+class TestStatusServer(unittest.TestCase):
+
+    def setUp(self):
+        self._registry = BuildRegistry()
+        self._server = StatusServer(('127.0.0.1', 0), self._registry)
+        self._server.start()
+        self._url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_phase_and_ring_buffer(self):
+        print 'test_phase_and_ring_buffer'
+        status = BuildStatus('job-id', 'my-project')
+        status.append_line('Running phase install\r\n')
+        self.assertEqual(status.phase, 'install')
+        for number in range(status_server.max_log_lines + 10):
+            status.append_line('line %d' % number)
+        lines = status.lines_after(0)
+        self.assertEqual(len(lines), status_server.max_log_lines)
+        self.assertEqual(lines[-1][1], 'line %d' % (status_server.max_log_lines + 9))
+        self.assertEqual(status.lines_after(lines[-1][0]), [])
+
+    def test_list_jobs(self):
+        print 'test_list_jobs'
+        status = self._registry.start('job-id', 'my-project')
+        status.append_line('Running phase build')
+        jobs = json.load(urllib2.urlopen(self._url + '/jobs'))
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0]['job_id'], 'job-id')
+        self.assertEqual(jobs[0]['phase'], 'build')
+        self.assertEqual(jobs[0]['state'], 'IN_PROGRESS')
+        self.assertTrue(jobs[0]['elapsed'] >= 0)
+
+        self.assertRaises(urllib2.HTTPError, urllib2.urlopen, self._url + '/jobs/unknown')
+
+    def test_logs(self):
+        print 'test_logs'
+        status = self._registry.start('job-id', 'my-project')
+        status.append_line('first')
+        status.append_line('second')
+        self.assertEqual(urllib2.urlopen(self._url + '/jobs/job-id/logs').read(), 'first\nsecond\n')
+
+    def test_stream_logs(self):
+        print 'test_stream_logs'
+        status = self._registry.start('job-id', 'my-project')
+        status.append_line('first')
+        connection = httplib.HTTPConnection('127.0.0.1', self._server.server_address[1])
+        connection.request('GET', '/jobs/job-id/logs', headers={'Accept': 'text/event-stream'})
+        # read the socket directly, HTTPResponse.read waits for a full buffer
+        response = connection.getresponse().fp
+        self.assertEqual(response.readline(), 'id: 1\n')
+        self.assertEqual(response.readline(), 'data: first\n')
+
+        def finish():
+            status.append_line('second')
+            status.finish(0)
+        threading.Thread(target=finish).start()
+        self.assertEqual(response.read(), '\nid: 2\ndata: second\n\nevent: end\ndata: SUCCEEDED\n\n')
+
+    def test_finished_builds_are_dropped(self):
+        print 'test_finished_builds_are_dropped'
+        for number in range(status_server.max_finished_builds + 5):
+            self._registry.start('job-%d' % number, 'my-project').finish(0)
+        self._registry.start('running', 'my-project')
+        builds = self._registry.list()
+        self.assertEqual(len(builds), status_server.max_finished_builds + 1)
+        self.assertEqual(builds[-1].job_id, 'running')
+
+if __name__ == '__main__':
+    unittest.main()
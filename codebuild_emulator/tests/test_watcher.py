@@ -0,0 +1,186 @@
+import unittest
+import os
+from os.path import join
+import json
+import shutil
+from watcher import SourceWatcher, WatchRules
+from codebuild_emulator import CodebuildRun
+from resilience import docker_breaker
+from test_emulator import test_project
+
+this_dir = os.path.dirname(os.path.realpath(__file__))
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+
+class TestWatcher(unittest.TestCase):
+
+    def setUp(self):
+        # other tests may have opened it while no docker daemon is running
+        docker_breaker.record_success()
+
+    def _prepare_test(self):
+        watched_dir = join(this_dir, 'tmp', 'watched')
+        shutil.rmtree(watched_dir, ignore_errors=True)
+        os.makedirs(join(watched_dir, 'src'))
+        os.makedirs(join(watched_dir, 'artifacts'))
+        for path in ['requirements.txt', join('src', 'app.py'), join('src', 'old.py')]:
+            with open(join(watched_dir, path), 'w') as watched_file:
+                watched_file.write('v1\n')
+        return watched_dir
+
+    def _change_files(self, watched_dir):
+        with open(join(watched_dir, 'src', 'app.py'), 'w') as app:
+            app.write('v2 longer\n')
+        open(join(watched_dir, 'src', 'new.py'), 'w').close()
+        os.unlink(join(watched_dir, 'src', 'old.py'))
+        open(join(watched_dir, 'artifacts', 'app.zip'), 'w').close()
+
+    def test_polling_watcher(self):
+        print 'test_polling_watcher'
+        watched_dir = self._prepare_test()
+        watcher = SourceWatcher(watched_dir, ignore=[join(watched_dir, 'artifacts')], interval=0.1, inotify=False)
+        self._change_files(watched_dir)
+        self.assertEqual(watcher.wait(), set([join('src', 'app.py'), join('src', 'new.py'), join('src', 'old.py')]))
+
+    @unittest.skipIf(pyinotify is None, 'pyinotify is not installed')
+    def test_inotify_watcher(self):
+        print 'test_inotify_watcher'
+        watched_dir = self._prepare_test()
+        watcher = SourceWatcher(watched_dir, ignore=[join(watched_dir, 'artifacts')], quiet_period=0.2)
+        self.assertTrue(watcher._notifier)
+        self._change_files(watched_dir)
+        self.assertEqual(watcher.wait(), set([join('src', 'app.py'), join('src', 'new.py'), join('src', 'old.py')]))
+
+    def test_rules(self):
+        print 'test_rules'
+        rules = WatchRules([{'phase': 'install', 'paths': ['requirements.txt']},
+                            {'phase': 'build', 'paths': ['src/*', '*.md']},
+                            {'phase': 'post_build', 'paths': ['README.md']}])
+        self.assertEqual(rules.phase_for(['src/app.py', 'README.md']), 'build')
+        self.assertEqual(rules.phase_for(['src/app.py', 'requirements.txt']), 'install')
+        self.assertEqual(rules.phase_for(['Makefile']), 'install')
+        self.assertEqual(WatchRules().phase_for(['src/app.py']), 'install')
+        self.assertRaises(Exception, WatchRules, [{'phase': 'deploy', 'paths': ['*']}])
+
+    def test_sync_sources(self):
+        print 'test_sync_sources'
+        watched_dir = self._prepare_test()
+        with open(join(watched_dir, 'buildspec.yml'), 'w') as buildspec:
+            buildspec.write('version: 0.2\n')
+        work_dir = join(this_dir, 'tmp', 'work')
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        run = CodebuildRun(test_project, watched_dir, work_dir)
+        run.prepare_dirs()
+
+        self._change_files(watched_dir)
+        run.sync_sources([join('src', 'app.py'), join('src', 'new.py'), join('src', 'old.py')])
+        readonly_src = join(work_dir, 'codebuild', 'readonly', 'src')
+        self.assertEqual(sorted(os.listdir(join(readonly_src, 'src'))), ['app.py', 'new.py'])
+        with open(join(readonly_src, 'src', 'app.py'), 'r') as app:
+            self.assertEqual(app.read(), 'v2 longer\n')
+        with open(join(work_dir, 'codebuild', 'output', 'changed_sources'), 'r') as changedfile:
+            self.assertEqual(json.load(changedfile), [join('src', 'app.py'), join('src', 'new.py'), join('src', 'old.py')])
+
+    def test_first_command_index(self):
+        print 'test_first_command_index'
+        work_dir = join(this_dir, 'tmp', 'work')
+        shutil.rmtree(work_dir, ignore_errors=True)
+        os.makedirs(work_dir)
+        run = CodebuildRun(test_project, join(this_dir, 'data', 'input', 'good', 'src'), work_dir)
+        run.prepare_dirs()
+        with open(join(work_dir, 'codebuild', 'output', 'plan.json'), 'w') as planfile:
+            json.dump([{'index': 0, 'phase': 'install', 'block': 'commands', 'command': 'pip install'},
+                       {'index': 1, 'phase': 'build', 'block': 'commands', 'command': 'make'},
+                       {'index': 2, 'phase': 'build', 'block': 'finally', 'command': 'make clean'}], planfile)
+        self.assertEqual(run.first_command_index('install'), 0)
+        self.assertEqual(run.first_command_index('pre_build'), 1)
+        self.assertEqual(run.first_command_index('post_build'), 3)
+
+    def test_exec_executor(self):
+        print 'test_exec_executor'
+        run = CodebuildRun(test_project, None, None)
+        api = ApiMock()
+        run._docker_client = DockerClientMock(api)
+        run._container = ContainerMock()
+        self.assertEqual(run.exec_executor(resume_from=4), 2)
+        self.assertEqual(api.command, ['env', 'CBEMU_RESUME_FROM=4', '/codebuild/readonly/bin/executor'])
+
+    def test_running_container_ignores_breaker(self):
+        print 'test_running_container_ignores_breaker'
+        run = CodebuildRun(test_project, None, None)
+        api = ApiMock()
+        run._docker_client = DockerClientMock(api)
+        run._container = ContainerMock()
+        for _ in range(10):
+            docker_breaker.record_failure()
+        self.assertEqual(run.exec_executor(), 2)
+        self.assertEqual(run.wait_for_container(), 3)
+        self.assertEqual(run._container.reloads, 2)
+
+    def test_logs_reconnect(self):
+        print 'test_logs_reconnect'
+        run = CodebuildRun(test_project, None, None)
+        run._container = LogsContainerMock()
+        written = []
+        run._write_log = written.append
+        self.assertEqual(run.wait_for_container(), 3)
+        self.assertEqual(''.join(written), 'first\nsecond\nthird\nfourth\n')
+        self.assertEqual(run._container.since, [None, 1556792131])
+
+
+class DockerClientMock:
+    def __init__(self, api):
+        self.api = api
+
+
+class ContainerMock:
+    id = 'container-id'
+    status = 'running'
+    attrs = {'State': {'ExitCode': 3}}
+    reloads = 0
+
+    def logs(self, **kwargs):
+        return iter([])
+
+    def reload(self):
+        self.reloads += 1
+        if self.reloads == 2:
+            self.status = 'exited'
+
+
+class LogsContainerMock(ContainerMock):
+    since = None
+
+    def logs(self, since=None, timestamps=False, **kwargs):
+        assert timestamps
+        self.since = (self.since or []) + [since]
+        if len(self.since) == 1:
+            return self._broken_stream()
+        # docker resends the whole second the stream was cut in
+        return iter(['2019-05-02T10:15:31.100000000Z first\n2019-05-02T10:15:31.2Z second\n',
+                     '2019-05-02T10:15:31.300000000Z third\n2019-05-02T10:15:32.000000000Z fourth\n'])
+
+    def _broken_stream(self):
+        yield '2019-05-02T10:15:31.100000000Z first\n2019-05-'
+        yield '02T10:15:31.2Z seco'
+        raise Exception('connection reset')
+
+
+class ApiMock:
+    def exec_create(self, container, command, tty=False):
+        self.command = command
+        return {'Id': 'exec-id'}
+
+    def exec_start(self, exec_id, stream=False):
+        return iter(['Running phase build\n', 'failed\n'])
+
+    def exec_inspect(self, exec_id):
+        return {'ExitCode': 2}
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+from os.path import join
+import json
+import time
+from fnmatch import fnmatch
+
+phase_names = ['install', 'pre_build', 'build', 'post_build']
+default_rules_file = '.cbemu-watch.json'
+
+
+# Blocks until files of a directory change and returns their paths relative to it.
+# Uses inotify through pyinotify when it is installed, otherwise compares snapshots of the tree.
+# Changes made while the caller is busy are returned by the next wait
+class SourceWatcher:
+
+    def __init__(self, directory, ignore=(), interval=1, quiet_period=0.5, inotify=True):
+        self._directory = os.path.realpath(directory)
+        self._ignore = ['.git']
+        for path in ignore:
+            relative = os.path.relpath(os.path.realpath(path), self._directory)
+            if not relative.startswith('..'):
+                self._ignore.append(relative)
+        self._interval = interval
+        self._quiet_period = quiet_period
+        self._notifier = None
+        self._changed = set()
+        if inotify:
+            self._start_inotify()
+        if not self._notifier:
+            self._snapshot = self._take_snapshot()
+
+    def _start_inotify(self):
+        try:
+            import pyinotify
+        except ImportError:
+            return
+        manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_ATTRIB | \
+            pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+        manager.add_watch(self._directory, mask, rec=True, auto_add=True,
+                          exclude_filter=lambda path: self._ignored(os.path.relpath(path, self._directory)))
+        self._notifier = pyinotify.Notifier(manager, default_proc_fun=self._add_event, timeout=None)
+
+    def _add_event(self, event):
+        relative = os.path.relpath(event.pathname, self._directory)
+        if not self._ignored(relative):
+            self._changed.add(relative)
+
+    def _ignored(self, relative):
+        return any(relative == path or relative.startswith(path + os.sep) for path in self._ignore)
+
+    def wait(self):
+        if self._notifier:
+            return self._wait_inotify()
+        return self._wait_polling()
+
+    # returns once nothing changed for quiet_period, an editor saving several files is one change
+    def _wait_inotify(self):
+        timeout = None
+        while True:
+            if self._notifier.check_events(timeout):
+                self._notifier.read_events()
+                self._notifier.process_events()
+            elif self._changed:
+                break
+            if self._changed:
+                timeout = int(self._quiet_period * 1000)
+        changed, self._changed = self._changed, set()
+        return changed
+
+    def _wait_polling(self):
+        while True:
+            time.sleep(self._interval)
+            snapshot = self._take_snapshot()
+            changed = set(path for path in set(snapshot) | set(self._snapshot)
+                          if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+            if changed:
+                return changed
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self._directory):
+            relative_root = os.path.relpath(root, self._directory)
+            if relative_root == '.':
+                relative_root = ''
+            dirs[:] = [name for name in dirs if not self._ignored(join(relative_root, name))]
+            for name in files:
+                path = join(root, name)
+                try:
+                    stat = os.lstat(path)
+                except OSError:
+                    continue
+                snapshot[join(relative_root, name)] = (stat.st_size, stat.st_mtime, stat.st_mode)
+        return snapshot
+
+
+# Which phase the build runs again from depends on the files that changed, for example
+# [{"phase": "build", "paths": ["src/*"]}] skips install and pre_build when only sources changed.
+# The first rule matching a file applies, files matching no rule run the whole build again
+class WatchRules:
+
+    def __init__(self, rules=()):
+        for rule in rules:
+            if rule.get('phase') not in phase_names:
+                raise Exception("Unknown phase %s in watch rules" % rule.get('phase'))
+        self._rules = rules
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'r') as rulesfile:
+            return cls(json.load(rulesfile))
+
+    def phase_for(self, paths):
+        phases = [phase_names[0]]
+        for path in paths:
+            matching = [rule['phase'] for rule in self._rules
+                        if any(fnmatch(path, pattern) for pattern in rule.get('paths', []))]
+            if not matching:
+                return phase_names[0]
+            phases.append(matching[0])
+        return min(phases[1:] or phases, key=phase_names.index)
@@ -13,4 +13,5 @@ setup(name='codebuild_emulator',
       scripts=['bin/cbemu'],
       install_requires=['boto3',
                         'click',
-                        'docker'])
+                        'docker'],
+      extras_require={'watch': ['pyinotify']})